@@ -0,0 +1,320 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+import riverapi.utils as utils
+
+import atexit
+import queue
+import threading
+import time
+
+
+class LabelBuffer:
+    """
+    Collect delayed labels and send them to the server in the background.
+
+    Labels are accumulated as (identifier, label, model_name) and flushed
+    when the buffer reaches batch_size, or when the oldest label has waited
+    max_age seconds, whichever comes first. Anything left is flushed on
+    close, which is also registered to run at exit. The server has no batch
+    label endpoint, so each label is still its own request: the buffer takes
+    them off the hot path, but does not reduce the number of requests.
+    """
+
+    def __init__(self, client, batch_size=100, max_age=5.0):
+        self.client = client
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.sent = 0
+        self.failed = 0
+        self._pending = []
+        self._oldest = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+
+        # Batches are taken and sent under one lock so labels go out in order
+        self._send_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        utils.on_fork(self)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-label-buffer]"
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, identifier, label, model_name):
+        """
+        Add a label for a previous prediction to be sent later.
+        """
+        with self._lock:
+            if self._closed:
+                logger.exit("This label buffer is closed.")
+            self._pending.append((identifier, label, model_name))
+
+            # Wake the thread to start the age timer, or when the batch is full
+            if len(self._pending) == 1:
+                self._oldest = time.monotonic()
+                self._wakeup.notify()
+            elif len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def flush(self):
+        """
+        Send all pending labels now.
+        """
+        with self._send_lock:
+            with self._lock:
+                batch = self._take()
+            self._send(batch)
+
+    def close(self):
+        """
+        Stop the background thread and flush anything remaining.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def after_fork(self):
+        """
+        In a forked child the thread is gone, and pending labels are the
+        parent's to send, so the child's copy is empty and closed.
+        """
+        atexit.unregister(self.close)
+        self._pending = []
+        self._oldest = None
+        self._closed = True
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._send_lock = threading.Lock()
+
+    def _take(self):
+        """
+        Take the pending batch (the lock must be held)
+        """
+        batch = self._pending
+        self._pending = []
+        self._oldest = None
+        return batch
+
+    def _due(self):
+        """
+        Determine if the pending batch should be sent (the lock must be held)
+        """
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.max_age
+
+    def _run(self):
+        """
+        Background loop to flush by size or age.
+        """
+        while True:
+            with self._lock:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(
+                            0, self.max_age - (time.monotonic() - self._oldest)
+                        )
+                    self._wakeup.wait(timeout)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _send(self, batch):
+        """
+        Send a batch of labels over the client's (kept alive) session (the
+        send lock must be held).
+        """
+        for identifier, label, model_name in batch:
+            try:
+                self.client.label(label, identifier, model_name)
+                self.sent += 1
+            except (Exception, SystemExit):
+                self.failed += 1
+                logger.warning(
+                    "Failed to send label for %s (%s)" % (identifier, model_name)
+                )
+
+
+class LearnQueue:
+    """
+    Hand learning samples to background workers and return immediately.
+
+    Samples go on a bounded queue. Workers take up to batch_size samples
+    at a time and send them, as one columnar request per model if the
+    server supports it. When the queue is full, put blocks (backpressure)
+    or, with block=False, the sample is dropped and counted. Anything
+    still queued is sent on close, which is also registered to run at exit.
+    """
+
+    def __init__(self, client, maxsize=10000, workers=2, batch_size=100, block=True):
+        self.client = client
+        self.batch_size = batch_size
+        self.block = block
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.close)
+        utils.on_fork(self)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-learn-queue]"
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def put(self, model_name, x, y=None, timeout=None):
+        """
+        Queue a sample to learn from. Returns False if it was dropped.
+        """
+        if self._closed:
+            logger.exit("This learn queue is closed.")
+        try:
+            self._queue.put((model_name, x, y), block=self.block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def flush(self):
+        """
+        Wait until everything queued so far has been sent.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Send anything queued and stop the workers.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        atexit.unregister(self.close)
+
+    def after_fork(self):
+        """
+        In a forked child the workers are gone, and queued samples are the
+        parent's to send, so the child's copy is empty and closed.
+        """
+        atexit.unregister(self.close)
+        self._closed = True
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _run(self):
+        """
+        Take batches from the queue and send them until we see a sentinel.
+        """
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            done = batch[-1] is None
+            samples = batch[:-1] if done else batch
+            try:
+                self._send(samples)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if done:
+                return
+
+    def _send(self, samples):
+        """
+        Send a batch of samples, grouped by model.
+        """
+        models = {}
+        for model_name, x, y in samples:
+            models.setdefault(model_name, []).append((x, y))
+
+        for model_name, items in models.items():
+            try:
+                sent = self._send_model(model_name, items)
+            except (Exception, SystemExit):
+                sent = 0
+                logger.warning(
+                    "Failed to send %s samples for %s" % (len(items), model_name)
+                )
+            with self._lock:
+                self.sent += sent
+                self.failed += len(items) - sent
+
+    def _send_model(self, model_name, items):
+        """
+        Send samples for one model, returning the number sent.
+        """
+        columns = list(items[0][0])
+        same = all(
+            len(x) == len(columns) and all(c in x for c in columns) for x, _ in items
+        )
+        if same and self.client.negotiate_format():
+            values = [[x[c] for x, _ in items] for c in columns]
+            labels = [y for _, y in items]
+            self.client.post_columns(
+                "/learn/batch/", model_name, columns, values, labels
+            )
+            return len(items)
+
+        sent = 0
+        for x, y in items:
+            try:
+                self.client.learn(model_name, x, y)
+                sent += 1
+            except (Exception, SystemExit):
+                logger.warning("Failed to send sample for %s" % model_name)
+        return sent
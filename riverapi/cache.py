@@ -0,0 +1,149 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from collections import OrderedDict
+from copy import deepcopy
+
+import json
+import re
+import threading
+import time
+
+
+class CacheEntry:
+    """
+    A cached response body with the validators the server sent for it.
+    """
+
+    def __init__(self, body, etag=None, last_modified=None, max_age=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.max_age = max_age
+        self.stored = time.monotonic()
+
+    @property
+    def validators(self):
+        """
+        Headers to make a conditional request for this entry.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def is_fresh(self):
+        """
+        An entry is fresh (served without asking the server) until max_age.
+        """
+        if not self.max_age:
+            return False
+        return time.monotonic() - self.stored < self.max_age
+
+    def content(self):
+        """
+        Return a copy of the body so callers cannot change the cache.
+        """
+        return deepcopy(self.body)
+
+
+class ResponseCache:
+    """
+    Cache GET responses following HTTP semantics.
+
+    Responses with an ETag or Last-Modified header are revalidated with
+    If-None-Match / If-Modified-Since, and a 304 is served from the cache.
+    A Cache-Control max-age is honored, and responses without validators
+    are kept for a short client-side ttl instead.
+    """
+
+    def __init__(self, ttl=2.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-response-cache]"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, url, data=None):
+        """
+        GET requests (e.g., stats and metrics) can send a json body, so it is
+        part of the key along with the url.
+        """
+        if data is None:
+            return url
+        return "%s %s" % (url, json.dumps(data, sort_keys=True))
+
+    def get(self, key):
+        """
+        Get an entry for a key, if we have one.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, response, body):
+        """
+        Store a response body, unless the server asks us not to.
+        """
+        cache_control = response.headers.get("Cache-Control", "").lower()
+        if "no-store" in cache_control:
+            self.discard(key)
+            return
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        max_age = None
+        match = re.search("max-age=([0-9]+)", cache_control)
+        if "no-cache" in cache_control:
+            max_age = 0
+        elif match:
+            max_age = int(match.group(1))
+        elif not etag and not last_modified:
+            max_age = self.ttl
+
+        with self._lock:
+            self._entries[key] = CacheEntry(body, etag, last_modified, max_age)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, entry, response):
+        """
+        A 304 means our entry is still good - restart its freshness. This is
+        the entry the request was made with, even if it has since been
+        cleared or evicted from the cache.
+        """
+        with self._lock:
+            entry.stored = time.monotonic()
+            entry.etag = response.headers.get("ETag") or entry.etag
+        return entry
+
+    def discard(self, key):
+        """
+        Remove a key from the cache.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Empty the cache.
+        """
+        with self._lock:
+            self._entries.clear()
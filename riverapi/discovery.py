@@ -0,0 +1,77 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+import riverapi.utils as utils
+
+import hashlib
+import os
+import tempfile
+import time
+
+
+class ServiceCache:
+    """
+    Remember service info (prefix, baseurl, formats and the auth realm) on
+    disk between processes, one small json file per server.
+
+    Entries older than ttl seconds are still used (so a new client can start
+    right away), but are refreshed by the client in the background.
+    """
+
+    def __init__(self, root=None, ttl=300):
+        self.root = os.path.abspath(
+            root
+            or os.environ.get("RIVER_ML_SERVICES")
+            or os.path.join(os.path.expanduser("~"), ".cache", "riverapi", "services")
+        )
+        self.ttl = ttl
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-service-cache:%s]" % self.root
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, "%s.json" % digest)
+
+    def load(self, key):
+        """
+        Load the entry for a server (its api root), or None.
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = utils.read_json(path)
+        except ValueError:
+            return None
+        return entry if entry.get("key") == key else None
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry.get("updated", 0) < self.ttl
+
+    def save(self, key, info=None, auth=None):
+        """
+        Save service info and/or the auth realm for a server. The file is
+        replaced atomically, so other processes never read half of it.
+        """
+        entry = self.load(key) or {"key": key}
+        if info is not None:
+            entry["info"] = info
+            entry["updated"] = time.time()
+        if auth is not None:
+            entry["auth"] = auth
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        os.close(fd)
+        utils.write_json(entry, tmp)
+        os.replace(tmp, self.path(key))
+        return entry
+
+    def clear(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,184 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import threading
+import time
+
+
+class LatencyTracker:
+    """
+    Keep a window of recent latencies (seconds) for each replica, and a
+    moving average that favors the most recent (smoothing is the weight
+    of a new latency), so a replica that turns slow is demoted quickly.
+    """
+
+    def __init__(self, replicas, window=200, smoothing=0.3):
+        self.latencies = {replica: deque(maxlen=window) for replica in replicas}
+        self.estimates = {replica: None for replica in replicas}
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+
+    def record(self, replica, seconds):
+        with self.lock:
+            self.latencies[replica].append(seconds)
+            self.update(replica, seconds)
+
+    def penalize(self, replica, seconds):
+        """
+        Count a request that is still running (seconds so far) toward the
+        average, without waiting for it to finish.
+        """
+        with self.lock:
+            if seconds > (self.estimates[replica] or 0):
+                self.update(replica, seconds)
+
+    def update(self, replica, seconds):
+        """
+        Add a latency to the moving average (the lock must be held).
+        """
+        estimate = self.estimates[replica]
+        if estimate is None:
+            self.estimates[replica] = seconds
+        else:
+            self.estimates[replica] = estimate + self.smoothing * (seconds - estimate)
+
+    def percentile(self, replica, percentile):
+        """
+        Get a percentile of recent latencies for a replica, or None if we
+        don't have enough to say.
+        """
+        with self.lock:
+            values = sorted(self.latencies[replica])
+        if len(values) < 10:
+            return None
+        index = min(len(values) - 1, int(len(values) * percentile / 100.0))
+        return values[index]
+
+    def ranked(self):
+        """
+        Replicas ordered from fastest (moving average) to slowest. Replicas
+        we have not heard from yet go first, so we learn about them.
+        """
+        with self.lock:
+            estimates = {r: e or 0 for r, e in self.estimates.items()}
+        return sorted(estimates, key=estimates.get)
+
+
+class Hedger:
+    """
+    Send a request to the fastest replica, and if it hasn't answered within
+    a percentile of its recent latency, send the same request to the next
+    fastest and take whichever answers first.
+
+    Hedges are capped to a fraction (budget) of all requests, so a slow
+    cluster does not get twice the load.
+    """
+
+    def __init__(
+        self, replicas, percentile=95, budget=0.1, default_delay=0.05, workers=16
+    ):
+        self.replicas = list(replicas)
+        self.percentile = percentile
+        self.budget = budget
+        self.default_delay = default_delay
+        self.workers = workers
+        self.tracker = LatencyTracker(self.replicas)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-hedger]"
+
+    def delay(self, replica):
+        """
+        How long to wait for a replica before sending a hedge.
+        """
+        delay = self.tracker.percentile(replica, self.percentile)
+        return self.default_delay if delay is None else delay
+
+    def allow_hedge(self):
+        """
+        Take a hedge from the budget, if there is one left.
+        """
+        with self.lock:
+            if self.hedged < self.budget * self.requests:
+                self.hedged += 1
+                return True
+        return False
+
+    def timed(self, fn, replica, started=None):
+        """
+        Run the request for a replica and record the latency.
+        """
+        if started is not None:
+            started.set()
+        start = time.monotonic()
+        try:
+            return fn(replica)
+        finally:
+            self.tracker.record(replica, time.monotonic() - start)
+
+    def run(self, fn):
+        """
+        Run fn(replica) with hedging, returning the first result.
+        """
+        with self.lock:
+            self.requests += 1
+        ranked = self.tracker.ranked()
+
+        # The delay counts from when the request starts, not time waiting
+        # for a free worker (which is not the replica being slow)
+        started = threading.Event()
+        primary = self.executor.submit(self.timed, fn, ranked[0], started)
+        started.wait()
+        start = time.monotonic()
+        done, _ = wait([primary], timeout=self.delay(ranked[0]))
+        if done:
+            return primary.result()
+
+        # A slow primary is demoted now, not when (or if) it finishes
+        self.tracker.penalize(ranked[0], time.monotonic() - start)
+        if len(ranked) < 2 or not self.allow_hedge():
+            return primary.result()
+
+        logger.debug("Hedging request to %s" % ranked[1])
+        hedge = self.executor.submit(self.timed, fn, ranked[1])
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [f for f in done if f.exception() is None]
+            if winners or not pending:
+
+                # The other request is cancelled if it has not started,
+                # otherwise its response is discarded when it finishes
+                for other in pending:
+                    other.cancel()
+                future = (winners or list(done))[0]
+                if future is hedge:
+                    self.tracker.penalize(ranked[0], time.monotonic() - start)
+                    with self.lock:
+                        self.hedge_wins += 1
+                return future.result()
+
+    def reset(self):
+        """
+        Start new workers and forget latencies (e.g., in a forked child).
+        """
+        self.tracker = LatencyTracker(self.replicas)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,162 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import time
+
+
+class AdaptiveLimiter:
+    """
+    Adjust the number of requests in flight from what the server tells us.
+
+    This is additive increase, multiplicative decrease (AIMD): after each
+    round (as many requests as the limit) that stays within tolerance of the
+    lowest latency we have seen, the limit goes up by one. If latency grows
+    past that (the server is queueing) or a request fails, the limit is cut
+    by the backoff factor, at most once per round.
+    """
+
+    def __init__(
+        self,
+        initial=4,
+        min_limit=1,
+        max_limit=64,
+        tolerance=2.0,
+        backoff=0.75,
+        smoothing=0.2,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.latency = None
+        self.baseline = None
+        self.requests = 0
+        self.errors = 0
+        self.decreases = 0
+        self.reset()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-adaptive-limiter:%s]" % int(self.limit)
+
+    def reset(self):
+        """
+        Start with nothing in flight (e.g., in a forked child).
+        """
+        self.in_flight = 0
+        self._round = 0
+        self._last_decrease = self.requests
+        self._cond = threading.Condition()
+
+    @property
+    def metrics(self):
+        """
+        The current limit, and the (smoothed) latency it converged to.
+        """
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "baseline_latency": self.baseline,
+            "requests": self.requests,
+            "errors": self.errors,
+            "decreases": self.decreases,
+        }
+
+    def acquire(self):
+        """
+        Wait until there is room for another request in flight.
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, error=False):
+        """
+        Record a finished request (latency in seconds) and adjust the limit.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if error:
+                self.errors += 1
+                self.decrease()
+            else:
+                self.observe(latency)
+            self._cond.notify_all()
+
+    def observe(self, latency):
+        """
+        Add a successful latency, and at the end of a round increase or
+        decrease the limit (the lock must be held).
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        # The baseline drifts up slowly, in case the server is now slower
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += 0.01 * (latency - self.baseline)
+
+        self._round += 1
+        if self._round < int(self.limit):
+            return
+        self._round = 0
+        if self.latency > self.tolerance * self.baseline:
+            self.decrease()
+        elif self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+    def decrease(self):
+        """
+        Cut the limit, unless we already did in this round.
+        """
+        if self.requests - self._last_decrease < int(self.limit):
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._last_decrease = self.requests
+        self._round = 0
+        self.decreases += 1
+        logger.debug("Concurrency limit is now %s" % int(self.limit))
+
+    def timed(self, fn, *args):
+        """
+        Run fn(*args) (a slot must be acquired) and release with its latency.
+        """
+        start = time.monotonic()
+        try:
+            result = fn(*args)
+        except BaseException:
+            self.release(time.monotonic() - start, error=True)
+            raise
+        self.release(time.monotonic() - start)
+        return result
+
+    def map(self, fn, items, return_exceptions=False):
+        """
+        Run fn(item) for each item with at most limit in flight, and return
+        results in order. With return_exceptions, an error is returned in
+        place of its result instead of raised.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_limit) as executor:
+            futures = []
+            for item in items:
+                self.acquire()
+                futures.append(executor.submit(self.timed, fn, item))
+            if not return_exceptions:
+                return [future.result() for future in futures]
+            return [future.exception() or future.result() for future in futures]
@@ -2,8 +2,14 @@ __author__ = "Vanessa Sochat"
 __copyright__ = "Copyright 2022, Vanessa Sochat"
 __license__ = "MPL 2.0"
 
+from logging.handlers import QueueHandler, QueueListener
 import logging as _logging
+import multiprocessing.util
+import atexit
+import json
 import platform
+import queue
+import random
 import sys
 import os
 import threading
@@ -25,11 +31,16 @@ class ColorizingStreamHandler(_logging.StreamHandler):
         "ERROR": RED,
     }
 
-    def __init__(self, nocolor=False, stream=sys.stderr, use_threads=False):
+    def __init__(
+        self, nocolor=False, stream=sys.stderr, use_threads=False, buffered=False
+    ):
         super().__init__(stream=stream)
         self._output_lock = threading.Lock()
         self.nocolor = nocolor or not self.can_color_tty()
 
+        # When buffered, the writer flushes (e.g., when it runs out of records)
+        self.buffered = buffered
+
     def can_color_tty(self):
         if "TERM" in os.environ and os.environ["TERM"] == "dumb":
             return False
@@ -43,10 +54,11 @@ class ColorizingStreamHandler(_logging.StreamHandler):
     def emit(self, record):
         with self._output_lock:
             try:
-                self.format(record)  # add the message to the record
-                self.stream.write(self.decorate(record))
+                message = self.format(record)  # add the message to the record
+                self.stream.write(self.decorate(record, message))
                 self.stream.write(getattr(self, "terminator", "\n"))
-                self.flush()
+                if not self.buffered:
+                    self.flush()
             except BrokenPipeError as e:
                 raise e
             except (KeyboardInterrupt, SystemExit):
@@ -55,15 +67,66 @@ class ColorizingStreamHandler(_logging.StreamHandler):
             except Exception:
                 self.handleError(record)
 
-    def decorate(self, record):
-        message = record.message
-        message = [message]
+    def decorate(self, record, message=None):
+        message = [message or record.message]
         if not self.nocolor and record.levelname in self.colors:
             message.insert(0, self.COLOR_SEQ % (30 + self.colors[record.levelname]))
             message.append(self.RESET_SEQ)
         return "".join(message)
 
 
+class JsonFormatter(_logging.Formatter):
+    """
+    Format each record as one line of json (structured logging).
+    """
+
+    def format(self, record):
+        record.message = record.getMessage()
+        return json.dumps(
+            {
+                "time": self.formatTime(record),
+                "level": record.levelname,
+                "message": record.message,
+                "thread": record.threadName,
+            }
+        )
+
+
+class LazyJson:
+    """
+    Pretty print json only if (and when) a message is actually written.
+    """
+
+    def __init__(self, getter):
+        self.getter = getter
+
+    def __str__(self):
+        return json.dumps(self.getter(), indent=4)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Put records on a queue for a background writer. Unlike the parent,
+    the message is not formatted here (in the hot path) but by the writer.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class BackgroundListener(QueueListener):
+    """
+    Write records from the queue in a background thread, flushing the
+    handlers only when the queue runs empty rather than every record.
+    """
+
+    def dequeue(self, block):
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+
 class Logger:
     def __init__(self):
         self.logger = _logging.getLogger(__name__)
@@ -74,6 +137,10 @@ class Logger:
         self.logfile = None
         self.last_msg_was_job_info = False
         self.logfile_handler = None
+        self.listener = None
+
+        # Endpoint (url prefix) to fraction of requests to log, e.g., {"/learn/": 0.01}
+        self.sample_rates = {}
 
     def cleanup(self):
         if self.logfile_handler is not None:
@@ -85,12 +152,55 @@ class Logger:
         for handler in self.log_handler:
             handler(msg)
 
-    def set_stream_handler(self, stream_handler):
+    def set_stream_handler(self, stream_handler, background=False):
+        """
+        Set the handler to write to. In the background, records are put on
+        a queue and written (and formatted) by a separate thread.
+        """
         if self.stream_handler is not None:
             self.logger.removeHandler(self.stream_handler)
+        self.stop_listener()
+        if background:
+            self.listener = BackgroundListener(queue.SimpleQueue(), stream_handler)
+            self.listener.start()
+            stream_handler = BackgroundHandler(self.listener.queue)
         self.stream_handler = stream_handler
         self.logger.addHandler(stream_handler)
 
+    def stop_listener(self):
+        """
+        Stop the background listener (if any), writing what is queued. This
+        is registered once to run at exit.
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self):
+        """
+        The listener thread does not exist in a forked child, so start a new
+        one (records the parent had queued are left for the parent). Worker
+        processes of multiprocessing exit without atexit, so stop it there
+        with a finalizer.
+        """
+        if self.listener is None:
+            return
+        self.listener = BackgroundListener(queue.SimpleQueue(), *self.listener.handlers)
+        self.listener.start()
+        self.stream_handler.queue = self.listener.queue
+
+    def sampled(self, url):
+        """
+        Determine if we should log a request to a url, given sample rates
+        by endpoint (the longest matching prefix wins).
+        """
+        rate = 1.0
+        matched = ""
+        for prefix, value in self.sample_rates.items():
+            if url.startswith(prefix) and len(prefix) >= len(matched):
+                rate, matched = value, prefix
+        return rate >= 1.0 or random.random() < rate
+
     def set_level(self, level):
         self.logger.setLevel(level)
 
@@ -102,17 +212,19 @@ class Logger:
             "{}: {info.filename}, {info.function}, {info.lineno}".format(msg, info=info)
         )
 
-    def info(self, msg):
-        self.handler(dict(level="info", msg=msg))
+    # Messages can be given with args (msg % args) to only format if needed
 
-    def warning(self, msg):
-        self.handler(dict(level="warning", msg=msg))
+    def info(self, msg, *args):
+        self.handler(dict(level="info", msg=msg, args=args))
 
-    def debug(self, msg):
-        self.handler(dict(level="debug", msg=msg))
+    def warning(self, msg, *args):
+        self.handler(dict(level="warning", msg=msg, args=args))
 
-    def error(self, msg):
-        self.handler(dict(level="error", msg=msg))
+    def debug(self, msg, *args):
+        self.handler(dict(level="debug", msg=msg, args=args))
+
+    def error(self, msg, *args):
+        self.handler(dict(level="error", msg=msg, args=args))
 
     def exit(self, msg, return_code=1):
         self.handler(dict(level="error", msg=msg))
@@ -133,14 +245,15 @@ class Logger:
             msg (dict):     the log message dictionary
         """
         level = msg["level"]
+        args = msg.get("args", ())
         if level == "info" and not self.quiet:
-            self.logger.info(msg["msg"])
+            self.logger.info(msg["msg"], *args)
         if level == "warning":
-            self.logger.warning(msg["msg"])
+            self.logger.warning(msg["msg"], *args)
         elif level == "error":
-            self.logger.error(msg["msg"])
+            self.logger.error(msg["msg"], *args)
         elif level == "debug":
-            self.logger.debug(msg["msg"])
+            self.logger.debug(msg["msg"], *args)
         elif level == "progress" and not self.quiet:
             done = msg["done"]
             total = msg["total"]
@@ -155,6 +268,15 @@ class Logger:
 
 
 logger = Logger()
+atexit.register(logger.stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=logger.after_fork)
+multiprocessing.util.register_after_fork(
+    logger,
+    lambda logger: multiprocessing.util.Finalize(
+        logger, logger.stop_listener, exitpriority=0
+    ),
+)
 
 
 def setup_logger(
@@ -165,14 +287,21 @@ def setup_logger(
     debug=False,
     use_threads=False,
     wms_monitor=None,
+    background=False,
+    json_logs=False,
+    sample_rates=None,
 ):
     # console output only if no custom logger was specified
     stream_handler = ColorizingStreamHandler(
-        nocolor=nocolor,
+        nocolor=nocolor or json_logs,
         stream=sys.stdout if stdout else sys.stderr,
         use_threads=use_threads,
+        buffered=background,
     )
-    logger.set_stream_handler(stream_handler)
+    if json_logs:
+        stream_handler.setFormatter(JsonFormatter())
+    logger.set_stream_handler(stream_handler, background=background)
+    logger.sample_rates = dict(sample_rates or {})
     logger.set_level(_logging.DEBUG if debug else _logging.INFO)
     logger.quiet = quiet
     logger.printshellcmds = printshellcmds
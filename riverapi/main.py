@@ -2,26 +2,97 @@ __author__ = "Vanessa Sochat"
 __copyright__ = "Copyright 2022, Vanessa Sochat"
 __license__ = "MPL 2.0"
 
-from riverapi.logger import logger
+from riverapi.logger import logger, LazyJson
 from riverapi.auth import parse_auth_header
+from riverapi.buffer import LearnQueue
+from riverapi.cache import ResponseCache
+from riverapi.discovery import ServiceCache
+from riverapi.hedging import Hedger
+from riverapi.limiter import AdaptiveLimiter
+from riverapi.outbox import Outbox, unavailable_codes
+from riverapi.record import Recorder
+from riverapi.singleflight import SingleFlight
+from riverapi.store import ModelCache
+from riverapi.transport import get_transport, transport_name
+import riverapi.wire as wire
 import riverapi.defaults as defaults
+import riverapi.utils as utils
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
+from functools import partial
+
+from json import dumps
 
 import base64
 import os
-import json
+import threading
+import time
 import dill
 import requests
 
+# The client for a worker process of map_processes
+_worker_client = None
+
+
+def _init_worker(client):
+    global _worker_client
+    _worker_client = client
+
+
+def _call_worker(fn, item):
+    return fn(_worker_client, item)
+
 
 class Client:
     """
     Interact with a River Server
     """
 
-    def __init__(self, baseurl=None, quiet=False, prefix="api"):
+    def __init__(
+        self,
+        baseurl=None,
+        quiet=False,
+        prefix="api",
+        cache=False,
+        cache_ttl=2.0,
+        model_cache=None,
+        bulk_format="auto",
+        replicas=None,
+        hedge_percentile=95,
+        hedge_budget=0.1,
+        transport=None,
+        outbox=None,
+        coalesce=False,
+        recorder=None,
+        adaptive=False,
+        discovery=False,
+    ):
+        # Service info from the background is applied between requests
+        self._service_lock = threading.RLock()
+        self._pending_service = None
+
+        # Settings to create the client again in another process
+        self._config = {
+            "baseurl": baseurl,
+            "quiet": quiet,
+            "cache": cache,
+            "cache_ttl": cache_ttl,
+            "model_cache": model_cache,
+            "bulk_format": bulk_format,
+            "replicas": replicas,
+            "hedge_percentile": hedge_percentile,
+            "hedge_budget": hedge_budget,
+            "transport": transport_name(transport),
+            "coalesce": coalesce,
+            "adaptive": bool(adaptive),
+            "discovery": discovery,
+        }
+
+        # A unix:// baseurl is served over a Unix domain socket
         self.baseurl = (baseurl or defaults.baseurl).strip("/")
+        self.transport, self.baseurl = get_transport(self.baseurl, transport)
         self.quiet = quiet
         self.flavors = [
             "regression",
@@ -32,10 +103,67 @@ class Client:
             "custom",
             "neighbor",
         ]
-        self.session = requests.session()
         self.headers = {"Accept": "application/json", "User-Agent": "riverapi-python"}
         self.prefix = prefix
+
+        # Optionally cache responses for polled (GET) endpoints
+        self.cache = ResponseCache(ttl=cache_ttl) if cache else None
+
+        # A shared model cache can be a directory or ModelCache
+        if model_cache is not None and not isinstance(model_cache, ModelCache):
+            model_cache = ModelCache(model_cache)
+        self.model_cache = model_cache
+
+        # Bulk requests use a compact format if the server supports one
+        self.bulk_format = bulk_format
+
+        # Optionally record requests (a path or Recorder) to replay later
+        if recorder is not None and not isinstance(recorder, Recorder):
+            recorder = Recorder(recorder)
+        self.recorder = recorder
+
+        # Identical read-only calls in flight at once can share one request
+        self.singleflight = SingleFlight() if coalesce else None
+
+        # Bulk functions can adapt how many requests are in flight
+        if adaptive and not isinstance(adaptive, AdaptiveLimiter):
+            adaptive = AdaptiveLimiter()
+        self.limiter = adaptive or None
+
+        # Created on first use of learn_async
+        self.learn_queue = None
+        self._learn_queue_lock = threading.Lock()
+
+        # Learn and label requests can be journaled when the server is down
+        if outbox is not None and not isinstance(outbox, Outbox):
+            outbox = Outbox(outbox)
+        self.outbox = outbox
+        if self.outbox is not None:
+            self.outbox.start(self)
+
+        # Predictions can be hedged across replicas that serve the same models
+        self.hedger = None
+        if replicas:
+            replicas = [self.baseurl] + [
+                r.strip("/") for r in replicas if r.strip("/") != self.baseurl
+            ]
+            self.hedger = Hedger(
+                replicas, percentile=hedge_percentile, budget=hedge_budget
+            )
         self.getenv()
+        utils.on_fork(self, "reset")
+
+        # Service info can be remembered on disk, and refreshed in the background
+        if discovery and not isinstance(discovery, ServiceCache):
+            discovery = ServiceCache(None if discovery is True else discovery)
+        self.discovery = discovery or None
+        self.service = {}
+        self.service_key = "%s/%s" % (
+            (baseurl or defaults.baseurl).strip("/"),
+            prefix.strip("/"),
+        )
+        if self.discovery is not None:
+            self.discover()
 
     def __repr__(self):
         return str(self)
@@ -43,6 +171,56 @@ class Client:
     def __str__(self):
         return "[riverapi-client]"
 
+    def __getstate__(self):
+        """
+        A pickled client keeps its settings, headers and token (so it does
+        not authenticate again), but no connections, threads, or files.
+        The outbox and recorder stay with the original client.
+        """
+        config = dict(self._config, prefix=self.prefix)
+        if not (config["baseurl"] or "").startswith("unix://"):
+            config["baseurl"] = self.baseurl
+        return {
+            "config": config,
+            "headers": self.headers,
+            "token": self.token,
+            "user": self.user,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state["config"])
+        self.headers.update(state["headers"])
+        self.token = state["token"]
+        self.user = state["user"]
+
+    def reset(self):
+        """
+        Re-create connections and anything run by threads, which are not
+        safe to share with a forked child. This is done automatically after
+        a fork. The outbox and recorder stay with the parent process.
+        """
+        self.transport.reset()
+        if self.hedger is not None:
+            self.hedger.reset()
+        if self.cache is not None:
+            self.cache = ResponseCache(ttl=self.cache.ttl)
+        if self.singleflight is not None:
+            self.singleflight = SingleFlight()
+        if self.limiter is not None:
+            self.limiter.reset()
+        self._service_lock = threading.RLock()
+        self.learn_queue = None
+        self._learn_queue_lock = threading.Lock()
+        self.outbox = None
+        self.recorder = None
+
+    @property
+    def session(self):
+        """
+        The requests session, if the transport uses one.
+        """
+        return getattr(self.transport, "session", None)
+
     @property
     def apiroot(self):
         """
@@ -56,11 +234,81 @@ class Client:
         prefix or baseurl if the server provides different ones.
         """
         info = self.info()
-        for field in ["prefix", "baseurl"]:
-            if field in info:
+        self.apply_service_info(info)
+        if self.discovery is not None:
+            self.discovery.save(self.service_key, info=info)
+
+    def apply_service_info(self, info):
+        """
+        Use service info: a different prefix or baseurl, and the formats
+        the server supports for bulk requests (if not chosen yet).
+        """
+        with self._service_lock:
+            self.service = info
+            for field in ["prefix", "baseurl"]:
+                if field not in info:
+                    continue
                 updated = info[field].strip("/")
-                print("Updating %s to %s" % (field, updated))
-                setattr(self, field, updated)
+                if updated != getattr(self, field):
+                    logger.info("Updating %s to %s" % (field, updated))
+                    setattr(self, field, updated)
+            if self.bulk_format == "auto" and "formats" in info:
+                self.bulk_format = wire.choose_format(info["formats"])
+
+    def service_root(self, baseurl=None):
+        """
+        Get the api root for a request. Service info refreshed in the
+        background is applied here, between requests, so a request never
+        sees half of an update.
+        """
+        with self._service_lock:
+            if self._pending_service is not None:
+                info, self._pending_service = self._pending_service, None
+                self.apply_service_info(info)
+            if baseurl:
+                return baseurl + "/" + self.prefix.strip("/")
+            return self.apiroot
+
+    def discover(self):
+        """
+        Use service info cached on disk right away, if we have it, and if
+        it's missing or older than the ttl, get it again in the background.
+        """
+        entry = self.discovery.load(self.service_key)
+        if entry is not None and "info" in entry:
+            self.apply_service_info(entry["info"])
+        refresh = not self.discovery.is_fresh(entry)
+        auth = (entry or {}).get("auth")
+        if refresh or (auth and self.token and self.user):
+            thread = threading.Thread(
+                target=self.refresh_service, args=(auth, refresh), daemon=True
+            )
+            thread.start()
+
+    def refresh_service(self, auth=None, refresh=True):
+        """
+        Get service info and save it to the service cache (it's used from
+        the next request). If we know the auth realm and have credentials,
+        get a token ahead of time too.
+        """
+        if auth and self.token and self.user and "Authorization" not in self.headers:
+            try:
+                self.set_basic_auth(self.user, self.token)
+                self.request_token(auth["realm"], auth.get("service"))
+            except (Exception, SystemExit) as e:
+                logger.debug("Cannot get a token ahead of time: %s" % e)
+        if not refresh:
+            return
+        try:
+            r = self.do_request("get", "/", return_json=False, exit_on_error=False)
+        except ConnectionError as e:
+            logger.debug("Cannot refresh service info: %s" % e)
+            return
+        if r.status_code == 200:
+            info = r.json()
+            with self._service_lock:
+                self._pending_service = info
+            self.discovery.save(self.service_key, info=info)
 
     def getenv(self):
         """
@@ -79,19 +327,27 @@ class Client:
                 % (flavor, " ".join(self.flavors))
             )
 
-    def check_response(self, typ, r, return_json=True, stream=False, retry=True):
+    def check_response(
+        self, typ, r, return_json=True, stream=False, retry=True, exit_on_error=True
+    ):
         """
-        Ensure the response status code is 20x
+        Ensure the response status code is 20x. If we are not asked to exit
+        on error, an unsuccessful response is returned for the caller.
         """
         if r.status_code == 401 and retry:
             if self.authenticate_request(r):
                 r.request.headers.update(self.headers)
-                r = self.session.send(r.request)
+                r = self.transport.send(r.request)
 
                 # Call itself once more just to check the status code
-                return self.check_response(typ, r, return_json, stream, retry=False)
+                return self.check_response(
+                    typ, r, return_json, stream, False, exit_on_error
+                )
 
-        if r.status_code not in [200, 201]:
+        # A 304 is only sent in response to a conditional (cached) request
+        if r.status_code not in [200, 201, 304] and not exit_on_error:
+            return r
+        if r.status_code not in [200, 201, 304]:
             logger.exit("Unsuccessful response: %s, %s" % (r.status_code, r.reason))
 
         # All data is typically json
@@ -129,18 +385,29 @@ class Client:
         if self.token and self.user:
             self.set_basic_auth(self.user, self.token)
 
-        headers = deepcopy(self.headers)
-        if "Authorization" not in headers:
+        if "Authorization" not in self.headers:
             logger.exit(
                 "This endpoint requires a token. Please export RIVER_ML_TOKEN and RIVER_ML_USER first."
             )
             return False
 
-        # Prepare request to retry
+        # Prepare request to retry (and remember the realm for next time)
         h = parse_auth_header(authHeaderRaw)
+        service = getattr(h, "Service", None)
+        if self.discovery is not None:
+            self.discovery.save(
+                self.service_key, auth={"realm": h.Realm, "service": service}
+            )
+        return self.request_token(h.Realm, service)
+
+    def request_token(self, realm, service=None):
+        """
+        Request a token from an auth realm, and use it for requests.
+        """
+        headers = deepcopy(self.headers)
         headers.update(
             {
-                "service": h.Service,
+                "service": service,
                 "Accept": "application/json",
                 "User-Agent": "riverapi-python",
             }
@@ -148,9 +415,9 @@ class Client:
 
         # Currently we don't set a scope (it defaults to build)
         try:
-            authResponse = requests.get(h.Realm, headers=headers).json()
+            authResponse = requests.get(realm, headers=headers).json()
         except:
-            logger.exit("Failed to get token from %s" % h.Realm)
+            logger.exit("Failed to get token from %s" % realm)
 
         # Request the token
         token = authResponse.get("token")
@@ -163,10 +430,9 @@ class Client:
 
     def print_response(self, r):
         """
-        Print the result of a response
+        Print the result of a response (only formatted if it is logged)
         """
-        response = r.json()
-        logger.info("%s: %s" % (r.url, json.dumps(response, indent=4)))
+        logger.info("%s: %s", r.url, LazyJson(r.json))
 
     def info(self):
         """
@@ -183,30 +449,85 @@ class Client:
         headers=None,
         return_json=True,
         stream=False,
+        baseurl=None,
+        exit_on_error=True,
     ):
         """
-        Do a request (get, post, etc)
+        Do a request (get, post, etc), to a different baseurl if provided.
         """
         # If we have a cached token, use it!
         headers = headers or {}
         headers.update(self.headers)
 
-        if not self.quiet:
-            logger.info("%s %s" % (typ.upper(), url))
+        apiroot = self.service_root(baseurl)
+
+        # Logging can be sampled per endpoint to keep it off the hot path
+        log = not self.quiet and logger.sampled(url)
+        if log:
+            logger.info("%s %s", typ.upper(), url)
 
         # The first post when you upload the model defines the flavor (regression)
+        # Requests go through the transport so connections are kept alive
+        started = time.time()
         if json:
-            r = requests.request(
-                typ, self.apiroot + url, json=json, headers=headers, stream=stream
+            r = self.transport.request(
+                typ, apiroot + url, json=json, headers=headers, stream=stream
             )
         else:
-            r = requests.request(
-                typ, self.apiroot + url, data=data, headers=headers, stream=stream
+            r = self.transport.request(
+                typ, apiroot + url, data=data, headers=headers, stream=stream
             )
 
-        if not self.quiet and not stream and return_json:
+        if self.recorder is not None:
+            self.recorder.record(
+                typ, url, data, json, r, started, time.time() - started, stream
+            )
+        if log and not stream and return_json:
             self.print_response(r)
-        return self.check_response(typ, r, return_json=return_json, stream=stream)
+        return self.check_response(
+            typ,
+            r,
+            return_json=return_json,
+            stream=stream,
+            exit_on_error=exit_on_error,
+        )
+
+    def do_cached_request(self, typ, url, json=None):
+        """
+        Do a conditional request, and serve the body from the cache if the
+        server tells us it has not been modified (304) or it is still fresh.
+        """
+        key = self.cache.key(self.apiroot + url, json)
+        entry = self.cache.get(key)
+        if entry is not None and entry.is_fresh():
+            self.cache.hits += 1
+            return entry.content()
+
+        headers = entry.validators if entry is not None else {}
+        r = self.do_request(typ, url, json=json, headers=headers, return_json=False)
+        if r.status_code == 304 and entry is not None:
+            self.cache.revalidated += 1
+            return self.cache.refresh(entry, r).content()
+
+        # We didn't make a conditional request, so there is nothing to serve
+        if r.status_code == 304:
+            logger.exit("Server sent 304 Not Modified for %s without validators." % url)
+
+        self.cache.misses += 1
+        body = r.json()
+        if not self.quiet and logger.sampled(url):
+            logger.info("%s: %s", r.url, LazyJson(lambda: body))
+        self.cache.store(key, r, body)
+        return deepcopy(body)
+
+    def coalesced(self, fn, *key):
+        """
+        Run fn, sharing the call with any identical one already in flight
+        (if the client was created with coalesce=True).
+        """
+        if self.singleflight is None:
+            return fn()
+        return self.singleflight.do(dumps(key, sort_keys=True, default=str), fn)
 
     def post(self, url, data=None, json=None, headers=None, return_json=True):
         """
@@ -216,6 +537,32 @@ class Client:
             "post", url, data=data, json=json, headers=headers, return_json=return_json
         )
 
+    def post_or_journal(self, url, json):
+        """
+        Perform a POST, and if we have an outbox and the server is unavailable
+        (or there is already a backlog, to keep the order) journal it to send
+        later. A journaled request returns None.
+        """
+        if self.outbox is None:
+            return self.post(url, json=json)
+        if self.outbox.pending:
+            self.outbox.append(url, json)
+            return
+
+        try:
+            r = self.do_request(
+                "post", url, json=json, return_json=False, exit_on_error=False
+            )
+        except ConnectionError:
+            r = None
+        if r is None or r.status_code in unavailable_codes:
+            logger.warning("Server is unavailable, journaling %s" % url)
+            self.outbox.append(url, json)
+            return
+        if not self.quiet and logger.sampled(url):
+            self.print_response(r)
+        return self.check_response("post", r)
+
     def delete(self, url, data=None, json=None, headers=None, return_json=True):
         """
         Perform a DELETE request
@@ -230,11 +577,20 @@ class Client:
         )
 
     def get(
-        self, url, data=None, json=None, headers=None, return_json=True, stream=False
+        self,
+        url,
+        data=None,
+        json=None,
+        headers=None,
+        return_json=True,
+        stream=False,
+        cache=False,
     ):
         """
-        Perform a GET request
+        Perform a GET request, optionally using the response cache.
         """
+        if cache and self.cache is not None and return_json and not stream:
+            return self.do_cached_request("get", url, json=json)
         return self.do_request(
             "get",
             url,
@@ -260,6 +616,8 @@ class Client:
             r = self.post("/model/%s/" % flavor, data=dill.dumps(model))
         model_name = r["name"]
         logger.info("Created model %s" % model_name)
+        if self.cache is not None:
+            self.cache.clear()
         return model_name
 
     def label(self, label, identifier, model_name):
@@ -273,7 +631,7 @@ class Client:
         then and should not need this endpoint. Also note that ground_truth
         of a prediction is synonymous with label here.
         """
-        return self.post(
+        return self.post_or_journal(
             "/label/",
             json={"model": model_name, "identifier": identifier, "label": label},
         )
@@ -286,21 +644,147 @@ class Client:
         for x, y in datasets.TrumpApproval().take(100):
             cli.train(x, y)
         """
-        return self.post(
+        return self.post_or_journal(
             "/learn/", json={"model": model_name, "features": x, "ground_truth": y}
         )
 
+    def negotiate_format(self):
+        """
+        Ask the server (once) which compact formats it supports for bulk
+        requests, and choose the best one we share. None means we send one
+        json request per sample.
+        """
+        if self.bulk_format == "auto":
+            formats = self.info().get("formats", [])
+            self.bulk_format = wire.choose_format(formats)
+        return self.bulk_format
+
+    def post_columns(self, url, model_name, columns, values, labels=None):
+        """
+        Post a chunk of samples in the negotiated columnar format.
+        """
+        payload = wire.columnar_payload(model_name, columns, values, labels)
+        body, content_type = wire.encode(payload, self.bulk_format)
+        return self.post(url, data=body, headers={"Content-Type": content_type})
+
+    def learn_async(self, model_name, x, y=None):
+        """
+        Queue a sample to learn from, and return right away. A background
+        LearnQueue sends samples in batches. Use learn_queue.flush() to wait
+        for them to be sent. To customize, set cli.learn_queue first.
+
+        cli.learn_async(model_name, x, y)
+        """
+        if self.learn_queue is None:
+            with self._learn_queue_lock:
+                if self.learn_queue is None:
+                    self.learn_queue = LearnQueue(self)
+        return self.learn_queue.put(model_name, x, y)
+
+    def map_requests(self, fn, items, workers=4, return_exceptions=False):
+        """
+        Run fn(item) for each item over threads, and return results in order.
+        With an adaptive limiter, it decides how many are in flight instead
+        of workers. With return_exceptions, errors are returned, not raised.
+        """
+        if self.limiter is not None:
+            return self.limiter.map(fn, items, return_exceptions)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fn, item) for item in items]
+            if not return_exceptions:
+                return [future.result() for future in futures]
+            return [future.exception() or future.result() for future in futures]
+
+    def learn_many(
+        self,
+        model_name,
+        X,
+        y=None,
+        columns=None,
+        target=None,
+        workers=4,
+        chunk_size=1000,
+    ):
+        """
+        Learn from a DataFrame or 2-D array. Provide y, or the name of a
+        target column in X. For an array, columns names the features.
+        Rows are converted in chunks and sent with a pool of workers, as
+        one columnar request per chunk if the server supports it.
+
+        cli.learn_many(model_name, df, target="y")
+        """
+        if self.negotiate_format():
+            chunks = utils.iter_columns(
+                X, y=y, columns=columns, target=target, chunk_size=chunk_size
+            )
+            return self.map_requests(
+                lambda c: self.post_columns("/learn/batch/", model_name, *c),
+                chunks,
+                workers,
+            )
+
+        results = []
+        for records, labels in utils.iter_records(
+            X, y=y, columns=columns, target=target, chunk_size=chunk_size
+        ):
+            labels = labels or [None] * len(records)
+            results += self.map_requests(
+                lambda item: self.learn(model_name, item[0], item[1]),
+                zip(records, labels),
+                workers,
+            )
+        return results
+
+    def predict_many(
+        self, model_name, X, columns=None, target=None, workers=4, chunk_size=1000
+    ):
+        """
+        Predict for each row of a DataFrame or 2-D array, and return the
+        predictions as an array in the same order as the input.
+
+        predictions = cli.predict_many(model_name, df[["x1", "x2"]])
+        """
+        import numpy
+
+        predictions = []
+        if self.negotiate_format():
+            chunks = utils.iter_columns(
+                X, columns=columns, target=target, chunk_size=chunk_size
+            )
+            for r in self.map_requests(
+                lambda c: self.post_columns("/predict/batch/", model_name, c[0], c[1]),
+                chunks,
+                workers,
+            ):
+                predictions += r["predictions"]
+            return numpy.asarray(predictions)
+
+        for records, _ in utils.iter_records(
+            X, columns=columns, target=target, chunk_size=chunk_size
+        ):
+            for r in self.map_requests(
+                lambda x: self.predict(model_name, x), records, workers
+            ):
+                predictions.append(r.get("prediction"))
+        return numpy.asarray(predictions)
+
     def delete_model(self, model_name):
         """
         Delete a model by name
         """
+        if self.cache is not None:
+            self.cache.clear()
         return self.delete("/model/", data={"model": model_name})
 
     def get_model_json(self, model_name):
         """
         Get a json respresentation of a model.
         """
-        return self.get("/model/%s/" % model_name)
+        return self.coalesced(
+            lambda: self.get("/model/%s/" % model_name, cache=True),
+            "model",
+            model_name,
+        )
 
     def download_model(self, model_name, dest=None):
         """
@@ -321,29 +805,215 @@ class Client:
                 f.write(chunk)
         return dest
 
-    def predict(self, model_name, x):
+    def load_model(self, model_name):
         """
-        Make a prediction
+        Load a model, downloading it into the shared model cache only if we
+        don't have the current version. Processes on the same node that use
+        the same cache directory share one download.
+
+        model = cli.load_model("muffled-pancake-9439")
         """
-        return self.post("/predict/", json={"model": model_name, "features": x})
+        if self.model_cache is None:
+            self.model_cache = ModelCache()
+        return self.model_cache.get(self, model_name)
+
+    def predict(self, model_name, x, label=None):
+        """
+        Make a prediction. If you already know the label (ground truth) you
+        can provide it, and the server will predict and then learn in one
+        request (and update metrics) instead of needing a separate learn.
+        """
+        data = {"model": model_name, "features": x}
+
+        # Predict with a label also learns, so it is never hedged or shared
+        if label is not None:
+            data["ground_truth"] = label
+            return self.post("/predict/", json=data)
+
+        if self.hedger is not None:
+            return self.coalesced(
+                lambda: self.hedger.run(
+                    lambda baseurl: self.do_request(
+                        "post", "/predict/", json=data, baseurl=baseurl
+                    )
+                ),
+                "predict",
+                data,
+            )
+        return self.coalesced(
+            lambda: self.post("/predict/", json=data), "predict", data
+        )
+
+    def evaluate(
+        self, model_name, iterable, metric=None, concurrency=1, checkpoint=1000
+    ):
+        """
+        Prequential (predict then learn) evaluation over (x, y) samples.
+
+        Each sample is one predict with its label, so the server predicts
+        and then learns from it in one request. By default one request is
+        in flight, so samples are learned strictly in order. A concurrency
+        above one pipelines requests for throughput, but then the server
+        can see them out of order (a sample can be predicted before the
+        previous few were learned, and they can be learned in any order),
+        so results for order sensitive models can vary between runs. The
+        (river) metric is always updated in order. Returns throughput and
+        metric at each checkpoint.
+
+        from river import metrics
+        report = cli.evaluate(model_name, dataset, metric=metrics.MAE())
+        """
+        start = time.time()
+        report = {"samples": 0, "checkpoints": []}
+
+        def add_checkpoint():
+            seconds = time.time() - start
+            point = {
+                "samples": report["samples"],
+                "seconds": seconds,
+                "throughput": report["samples"] / seconds if seconds else 0,
+                "metric": metric.get() if metric is not None else None,
+            }
+            report["checkpoints"].append(point)
+            logger.info(
+                "%s samples, %.2f/second, metric %s",
+                point["samples"],
+                point["throughput"],
+                point["metric"],
+            )
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            def finish():
+                y, future = pending.popleft()
+                prediction = future.result().get("prediction")
+                if metric is not None:
+                    metric.update(y, prediction)
+                report["samples"] += 1
+                if checkpoint and report["samples"] % checkpoint == 0:
+                    add_checkpoint()
+
+            for x, y in iterable:
+                if len(pending) >= concurrency:
+                    finish()
+                pending.append(
+                    (y, executor.submit(self.predict, model_name, x, label=y))
+                )
+            while pending:
+                finish()
+
+        checkpoints = report["checkpoints"]
+        if not checkpoints or checkpoints[-1]["samples"] != report["samples"]:
+            add_checkpoint()
+        report.update(report["checkpoints"][-1])
+        return report
 
     def models(self):
         """
         Get a listing of known models
         """
-        return self.get("/models/")
+        return self.get("/models/", cache=True)
+
+    def iter_models(self, chunk_size=65536):
+        """
+        Iterate over model names as the listing streams in, so a server
+        with thousands of models doesn't need one giant response in memory.
+        """
+        with self.get("/models/", stream=True, return_json=False) as r:
+            yield from utils.iter_json_list(r.iter_content(chunk_size), "models")
+
+    def run_many(self, fn, items, workers=8):
+        """
+        Run fn(*args) for (model_name, args) items in parallel, and return
+        a lookup of model name to {"result": ...} or {"error": ...}
+        """
+        items = list(items)
+        results = self.map_requests(
+            lambda item: fn(*item[1]), items, workers, return_exceptions=True
+        )
+        lookup = {}
+        for (model_name, _), result in zip(items, results):
+            if isinstance(result, SystemExit):
+                lookup[model_name] = {"error": "Unsuccessful response (see log)"}
+            elif isinstance(result, Exception):
+                lookup[model_name] = {
+                    "error": "%s: %s" % (result.__class__.__name__, result)
+                }
+            else:
+                lookup[model_name] = {"result": result}
+        return lookup
+
+    def map_processes(self, fn, iterable, workers=None, chunksize=1):
+        """
+        Run fn(client, item) for each item over worker processes, for work
+        that is heavy on the CPU (e.g., features) and also calls the server.
+        Each process gets its own copy of this client (with its token) and
+        keeps its connections open across items. fn must be importable
+        (defined at the top level of a module). Results are in order.
+        """
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(self,)
+        ) as executor:
+            return list(
+                executor.map(partial(_call_worker, fn), iterable, chunksize=chunksize)
+            )
+
+    def upload_models(self, models, workers=8):
+        """
+        Upload many models at once, given a lookup of model name to a tuple
+        of (model, flavor).
+
+        cli.upload_models({"fugly-mango": (model, "regression")})
+        """
+        items = [
+            (name, (model, flavor, name)) for name, (model, flavor) in models.items()
+        ]
+        return self.run_many(self.upload_model, items, workers)
+
+    def delete_models(self, model_names, workers=8):
+        """
+        Delete many models at once.
+        """
+        return self.run_many(
+            self.delete_model, [(name, (name,)) for name in model_names], workers
+        )
+
+    def stats_many(self, model_names, workers=8):
+        """
+        Get stats for many models at once.
+        """
+        return self.run_many(
+            self.stats, [(name, (name,)) for name in model_names], workers
+        )
+
+    def metrics_many(self, model_names, workers=8):
+        """
+        Get metrics for many models at once.
+        """
+        return self.run_many(
+            self.metrics, [(name, (name,)) for name in model_names], workers
+        )
 
     def stats(self, model_name):
         """
         Get stats for a model name
         """
-        return self.get("/stats/", json={"model": model_name})
+        return self.coalesced(
+            lambda: self.get("/stats/", json={"model": model_name}, cache=True),
+            "stats",
+            model_name,
+        )
 
     def metrics(self, model_name):
         """
         Get metrics for a model name
         """
-        return self.get("/metrics/", json={"model": model_name})
+        return self.coalesced(
+            lambda: self.get("/metrics/", json={"model": model_name}, cache=True),
+            "metrics",
+            model_name,
+        )
 
     def stream(self, url):
         """
@@ -356,14 +1026,18 @@ class Client:
                         line = line.decode("utf-8")
                     yield line
 
-    def stream_metrics(self):
+    def stream_metrics(self, model_name=None):
         """
-        Stream metrics
+        Stream metrics, optionally asking the server to filter to a model
         """
+        if model_name:
+            return self.stream("/stream/metrics/?model=%s" % model_name)
         return self.stream("/stream/metrics/")
 
-    def stream_events(self):
+    def stream_events(self, model_name=None):
         """
-        Stream events
+        Stream events, optionally asking the server to filter to a model
         """
+        if model_name:
+            return self.stream("/stream/events/?model=%s" % model_name)
         return self.stream("/stream/events/")
@@ -0,0 +1,264 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+import riverapi.utils as utils
+
+import json
+import os
+import threading
+import time
+
+# Policies for when appended records are forced to disk
+fsync_policies = ["always", "interval", "never"]
+
+# Responses that mean the server is unavailable (so we keep the request).
+# A 500 is an error for this request, so it's rejected instead of blocking
+unavailable_codes = [429, 502, 503, 504]
+
+
+class Outbox:
+    """
+    A durable, append-only journal of learn and label requests that could
+    not be sent, replayed in order once the server is back.
+
+    Records are json lines in numbered segment files, and a new segment is
+    started when the current one reaches segment_size. The position of the
+    last acknowledged (sent) record is kept in an "acked" file, and segments
+    that are completely acknowledged are removed. Delivery is at least once:
+    if we crash between sending and saving the position, a record can be
+    sent again.
+    """
+
+    def __init__(
+        self,
+        root,
+        segment_size=16 * 1024 * 1024,
+        fsync="interval",
+        fsync_interval=1.0,
+        replay_interval=5.0,
+    ):
+        if fsync not in fsync_policies:
+            logger.exit(
+                "%s is not a valid fsync policy. Choices are: %s"
+                % (fsync, " ".join(fsync_policies))
+            )
+        self.root = os.path.abspath(root)
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        self.appended = 0
+        self.replayed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._synced = time.monotonic()
+        self._thread = None
+        self._stop = threading.Event()
+        os.makedirs(self.root, exist_ok=True)
+
+        self.acked = self.read_acked()
+        segments = self.segments()
+        self._segment = segments[-1] if segments else self.acked[0]
+        self._fd = open(self.segment_path(self._segment), "ab")
+        self.pending = self.count_pending()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-outbox:%s]" % self.root
+
+    @property
+    def metrics(self):
+        """
+        Backlog depth and counters.
+        """
+        segments = self.segments()
+        return {
+            "pending": self.pending,
+            "pending_bytes": sum(
+                os.path.getsize(self.segment_path(s)) for s in segments
+            )
+            - self.acked[1],
+            "segments": len(segments),
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+        }
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, "%020d.log" % segment)
+
+    def segments(self):
+        """
+        Numbers of the segment files on disk, in order.
+        """
+        return sorted(
+            int(f.split(".")[0]) for f in os.listdir(self.root) if f.endswith(".log")
+        )
+
+    def read_acked(self):
+        """
+        Read the acknowledged position (segment, offset).
+        """
+        path = os.path.join(self.root, "acked")
+        if not os.path.exists(path):
+            segments = self.segments()
+            return (segments[0] if segments else 0, 0)
+        acked = utils.read_json(path)
+        return (acked["segment"], acked["offset"])
+
+    def write_acked(self, segment, offset):
+        """
+        Atomically save the acknowledged position, and remove segments
+        before it (compaction).
+        """
+        path = os.path.join(self.root, "acked")
+        utils.write_json({"segment": segment, "offset": offset}, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.acked = (segment, offset)
+        for old in self.segments():
+            if old < segment:
+                os.remove(self.segment_path(old))
+
+    def count_pending(self):
+        """
+        Count records after the acknowledged position.
+        """
+        count = 0
+        for _, _, _ in self.iter_records():
+            count += 1
+        return count
+
+    def append(self, url, data):
+        """
+        Journal a request to send later.
+        """
+        line = json.dumps({"url": url, "json": data}).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._fd.tell() >= self.segment_size:
+                self.rotate()
+            self._fd.write(line)
+            self._fd.flush()
+            if self.fsync == "always":
+                os.fsync(self._fd.fileno())
+            elif self.fsync == "interval":
+                self.sync(force=False)
+            self.appended += 1
+            self.pending += 1
+
+    def rotate(self):
+        """
+        Start a new segment (the lock must be held).
+        """
+        if self.fsync != "never":
+            os.fsync(self._fd.fileno())
+        self._fd.close()
+        self._segment += 1
+        self._fd = open(self.segment_path(self._segment), "ab")
+
+    def sync(self, force=True):
+        """
+        Force appended records to disk (if it is time to, unless forced).
+        """
+        if force or time.monotonic() - self._synced >= self.fsync_interval:
+            os.fsync(self._fd.fileno())
+            self._synced = time.monotonic()
+
+    def iter_records(self):
+        """
+        Yield (segment, next offset, record) from the acknowledged position.
+        A partial last line (still being written) is not yielded.
+        """
+        segment, offset = self.acked
+        for number in self.segments():
+            if number < segment:
+                continue
+            with open(self.segment_path(number), "rb") as fd:
+                fd.seek(offset if number == segment else 0)
+                for line in iter(fd.readline, b""):
+                    if not line.endswith(b"\n"):
+                        break
+                    yield number, fd.tell(), json.loads(line)
+
+    def replay(self, client, batch=100):
+        """
+        Send journaled requests in order, stopping at the first one that
+        fails because the server is unavailable. Requests the server rejects
+        (e.g., 400 or 500) are dropped with a warning. Returns the number sent.
+        """
+        sent = 0
+        with self._replay_lock:
+            position = None
+            count = 0
+            try:
+                for segment, offset, record in self.iter_records():
+                    try:
+                        r = client.do_request(
+                            "post",
+                            record["url"],
+                            json=record["json"],
+                            return_json=False,
+                            exit_on_error=False,
+                        )
+                    except ConnectionError:
+                        break
+                    if r.status_code in unavailable_codes:
+                        break
+                    if r.status_code not in [200, 201]:
+                        logger.warning(
+                            "Dropping journaled %s: %s, %s"
+                            % (record["url"], r.status_code, r.reason)
+                        )
+                        self.rejected += 1
+                    else:
+                        self.replayed += 1
+                        sent += 1
+                    with self._lock:
+                        self.pending -= 1
+                    position = (segment, offset)
+                    count += 1
+                    if count % batch == 0:
+                        self.write_acked(*position)
+
+            # Keep what was sent, even if a request raised
+            finally:
+                if position is not None:
+                    self.write_acked(*position)
+        return sent
+
+    def start(self, client):
+        """
+        Replay in the background every replay_interval seconds.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(client,), daemon=True)
+        self._thread.start()
+
+    def _run(self, client):
+        while not self._stop.wait(self.replay_interval):
+            with self._lock:
+                if self.fsync == "interval":
+                    self.sync(force=False)
+            if not self.pending:
+                continue
+            try:
+                self.replay(client)
+            except (Exception, SystemExit) as e:
+                logger.warning("Cannot replay the outbox, will retry: %s" % e)
+
+    def close(self):
+        """
+        Stop replaying and close the current segment.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self.fsync != "never":
+                os.fsync(self._fd.fileno())
+            self._fd.close()
@@ -0,0 +1,338 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+from riverapi.main import Client
+
+import bisect
+import dill
+import hashlib
+import threading
+import uuid
+
+
+class HashRing:
+    """
+    A consistent hash ring, so adding or removing a member only moves the
+    keys that member owns. Each member is placed at many (virtual) points.
+    """
+
+    def __init__(self, members=None, replicas=100):
+        self.replicas = replicas
+        self.members = set()
+        self._keys = []
+        self._points = {}
+        for member in members or []:
+            self.add(member)
+
+    def hash(self, key):
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def add(self, member):
+        if member in self.members:
+            return
+        self.members.add(member)
+        for i in range(self.replicas):
+            point = self.hash("%s#%s" % (member, i))
+            self._points[point] = member
+            bisect.insort(self._keys, point)
+
+    def remove(self, member):
+        if member not in self.members:
+            return
+        self.members.remove(member)
+        for i in range(self.replicas):
+            point = self.hash("%s#%s" % (member, i))
+            del self._points[point]
+            self._keys.remove(point)
+
+    def get(self, key):
+        """
+        Get the member that owns a key.
+        """
+        if not self._keys:
+            logger.exit("There are no members available in the ring.")
+        index = bisect.bisect(self._keys, self.hash(key)) % len(self._keys)
+        return self._points[self._keys[index]]
+
+
+class ClientPool:
+    """
+    Shard models across several river servers.
+
+    Each model is owned by one server, chosen by consistent hashing of the
+    model name (or a placement you provide), and requests for a model are
+    routed to its owner. Members that fail a health check are taken out of
+    the ring until they recover, and then get their models back. When membership changes, models that move
+    stay pinned to their old owner until they are migrated, which happens
+    right away unless auto_rebalance is False.
+
+    pool = ClientPool(["http://river-1:8000", "http://river-2:8000"])
+    pool.learn(model_name, x, y)
+    """
+
+    def __init__(
+        self, baseurls, placements=None, replicas=100, auto_rebalance=True, **kwargs
+    ):
+        self.clients = {}
+        self.placements = dict(placements or {})
+        self.ring = HashRing(replicas=replicas)
+        self.auto_rebalance = auto_rebalance
+        self.kwargs = kwargs
+
+        # Models that moved owner but are not migrated yet (model: old owner)
+        self.moving = {}
+
+        # Models still on a member that went down (model: that member)
+        self.stranded = {}
+
+        # Models we know about (and their flavor, if we uploaded them)
+        self.known = {}
+        self.lock = threading.Lock()
+        for baseurl in baseurls:
+            self.add_member(baseurl)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-client-pool]"
+
+    @property
+    def members(self):
+        return list(self.clients)
+
+    def owner(self, model_name):
+        """
+        Get the baseurl of the server that owns a model.
+        """
+        if model_name in self.placements:
+            return self.placements[model_name]
+        with self.lock:
+            if model_name in self.moving:
+                return self.moving[model_name]
+            return self.ring.get(model_name)
+
+    def client(self, model_name):
+        """
+        Get the client for the server that owns a model.
+        """
+        return self.clients[self.owner(model_name)]
+
+    def place(self, model_name, baseurl):
+        """
+        Pin a model to a specific server, overriding the hash ring.
+        """
+        if baseurl not in self.clients:
+            logger.exit("%s is not a member of this pool." % baseurl)
+        self.placements[model_name] = baseurl
+
+    def add_member(self, baseurl):
+        """
+        Add a server, and return the models that are now owned by it.
+        """
+        baseurl = baseurl.strip("/")
+        if baseurl not in self.clients:
+            self.clients[baseurl] = Client(baseurl, **self.kwargs)
+        return self.changed(self.update_ring(lambda: self.ring.add(baseurl)))
+
+    def remove_member(self, baseurl):
+        """
+        Remove a server, and return the models that move elsewhere. They
+        are always migrated before the server is dropped.
+        """
+        baseurl = baseurl.strip("/")
+        moves = self.update_ring(lambda: self.ring.remove(baseurl))
+        if moves:
+            self.rebalance(moves)
+        self.clients.pop(baseurl, None)
+        self.placements = {k: v for k, v in self.placements.items() if v != baseurl}
+        with self.lock:
+            self.moving = {k: v for k, v in self.moving.items() if v != baseurl}
+            self.stranded = {k: v for k, v in self.stranded.items() if v != baseurl}
+        return moves
+
+    def changed(self, moves):
+        """
+        Migrate models that moved after a membership change, if we should.
+        """
+        if self.auto_rebalance and moves:
+            self.rebalance(moves)
+        return moves
+
+    def update_ring(self, change, pin=True):
+        """
+        Change the ring, and return {model: (old owner, new owner)} for the
+        known models that change owner. With pin, they are still routed to
+        the old owner until they are migrated (see rebalance). Models on a
+        member that was down move from that member once it's back.
+        """
+        with self.lock:
+            before = {m: self.ring.get(m) for m in self.known if self.ring.members}
+            change()
+            if not self.ring.members:
+                return {}
+            moves = {}
+            for model_name, old in before.items():
+                new = self.ring.get(model_name)
+                if model_name in self.stranded:
+                    old = self.stranded[model_name]
+                    if old not in self.ring.members:
+                        continue
+                    del self.stranded[model_name]
+                if old != new and model_name not in self.placements:
+                    moves[model_name] = (old, new)
+                    if pin and model_name not in self.moving:
+                        self.moving[model_name] = old
+        return moves
+
+    def health_check(self):
+        """
+        Ping each member with info(). Members that fail are taken out of
+        the ring and members that recover are added back. Returns a lookup
+        of baseurl to True (healthy) or False, and the models that moved.
+        """
+        healthy = {}
+        moves = {}
+        for baseurl, client in list(self.clients.items()):
+            try:
+                client.info()
+                healthy[baseurl] = True
+            except (Exception, SystemExit):
+                healthy[baseurl] = False
+
+            # Models on a member that is down can't stay pinned there
+            if healthy[baseurl] and baseurl not in self.ring.members:
+                logger.info("%s is healthy, adding to the ring." % baseurl)
+                moves.update(
+                    self.changed(self.update_ring(lambda: self.ring.add(baseurl)))
+                )
+            elif not healthy[baseurl] and baseurl in self.ring.members:
+                logger.warning("%s is not healthy, removing from ring." % baseurl)
+                with self.lock:
+                    located = [
+                        m
+                        for m in self.known
+                        if m not in self.stranded
+                        and self.moving.get(m, self.ring.get(m)) == baseurl
+                    ]
+                moves.update(
+                    self.update_ring(lambda: self.ring.remove(baseurl), pin=False)
+                )
+
+                # Remember where they are, to route them back on recovery
+                with self.lock:
+                    self.moving = {k: v for k, v in self.moving.items() if v != baseurl}
+                    for model_name in located:
+                        self.stranded[model_name] = baseurl
+        return healthy, moves
+
+    def migrate(self, model_name, source, dest):
+        """
+        Move a model from one server to another (download, upload, delete).
+        We need to know the flavor, so the model must be uploaded via the pool.
+        Returns None if the source does not have the model.
+        """
+        flavor = self.known.get(model_name)
+        if not flavor:
+            logger.warning("Flavor of %s is unknown, cannot migrate." % model_name)
+            return False
+        client = self.clients[source]
+        r = client.do_request(
+            "get",
+            "/model/download/%s/" % model_name,
+            return_json=False,
+            exit_on_error=False,
+        )
+        if r.status_code == 404:
+            logger.warning(
+                "%s is not on %s, routing to %s." % (model_name, source, dest)
+            )
+            return None
+        r = client.check_response("get", r, return_json=False)
+        model = dill.loads(r.content)
+        self.clients[dest].upload_model(model, flavor, model_name=model_name)
+        self.clients[source].delete_model(model_name)
+        return True
+
+    def rebalance(self, moves):
+        """
+        Migrate models that moved owner (as returned by add_member or
+        remove_member), and route them to the new owner once they are
+        there. Sources that are gone (or don't have the model) cannot be
+        migrated from.
+        """
+        migrated = {}
+        for model_name, (source, dest) in moves.items():
+            result = False
+            missing = source not in self.clients
+            if not missing:
+                try:
+                    result = self.migrate(model_name, source, dest)
+                    missing = result is None
+                except (Exception, SystemExit) as e:
+                    logger.warning("Failed to migrate %s: %s" % (model_name, e))
+            migrated[model_name] = bool(result)
+
+            # A model that failed to migrate stays with its old owner
+            if migrated[model_name] or missing:
+                with self.lock:
+                    self.moving.pop(model_name, None)
+        return migrated
+
+    def upload_model(self, model, flavor, model_name=None):
+        """
+        Upload a model to its owner. Without a name, the server generates
+        one, so we place the model on a random member and pin it there.
+        """
+        if model_name:
+            client = self.client(model_name)
+        else:
+            with self.lock:
+                baseurl = self.ring.get(str(uuid.uuid4()))
+            client = self.clients[baseurl]
+        model_name = client.upload_model(model, flavor, model_name=model_name)
+        self.known[model_name] = flavor
+        if self.owner(model_name) != client.baseurl:
+            self.placements[model_name] = client.baseurl
+        return model_name
+
+    def models(self):
+        """
+        Get a listing of models across all servers in the ring.
+        """
+        models = []
+        for baseurl in self.ring.members:
+            models += self.clients[baseurl].models().get("models", [])
+        return {"models": models}
+
+    def learn(self, model_name, x, y=None):
+        return self.client(model_name).learn(model_name, x, y)
+
+    def predict(self, model_name, x, label=None):
+        return self.client(model_name).predict(model_name, x, label=label)
+
+    def label(self, label, identifier, model_name):
+        return self.client(model_name).label(label, identifier, model_name)
+
+    def stats(self, model_name):
+        return self.client(model_name).stats(model_name)
+
+    def metrics(self, model_name):
+        return self.client(model_name).metrics(model_name)
+
+    def get_model_json(self, model_name):
+        return self.client(model_name).get_model_json(model_name)
+
+    def download_model(self, model_name, dest=None):
+        return self.client(model_name).download_model(model_name, dest)
+
+    def delete_model(self, model_name):
+        result = self.client(model_name).delete_model(model_name)
+        self.known.pop(model_name, None)
+        self.placements.pop(model_name, None)
+        with self.lock:
+            self.moving.pop(model_name, None)
+            self.stranded.pop(model_name, None)
+        return result
@@ -0,0 +1,278 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+import riverapi.utils as utils
+
+from concurrent.futures import ThreadPoolExecutor
+
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    Summarize a list of latencies (seconds).
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    summary = {"mean": sum(values) / len(values), "max": values[-1]}
+    for point in points:
+        index = min(len(values) - 1, int(len(values) * point / 100.0))
+        summary["p%s" % point] = values[index]
+    return summary
+
+
+def digest(content):
+    if content is None:
+        return None
+    return hashlib.sha256(content).hexdigest()
+
+
+class Recorder:
+    """
+    Record requests to a compact (gzipped json lines) log to replay later.
+
+    Each record has the method, endpoint, model, payload, timestamp,
+    latency, status code, a hash of the response body and the start of the
+    body (up to max_body characters) to show differences on replay. The log
+    is flushed every flush_every records, at least every flush_interval
+    seconds, and on close (which is also registered to run at exit).
+    """
+
+    def __init__(self, path, max_body=2048, flush_every=100, flush_interval=1.0):
+        self.path = path
+        self.max_body = max_body
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._fd = gzip.open(path, "at")
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        utils.on_fork(self)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-recorder:%s]" % self.path
+
+    def record(self, typ, url, data, json_data, response, started, latency, stream):
+        """
+        Record one request, given the response and latency (seconds).
+        """
+        record = {
+            "method": typ,
+            "url": url,
+            "model": (
+                (json_data or {}).get("model") if isinstance(json_data, dict) else None
+            ),
+            "time": started,
+            "latency": latency,
+            "status": response.status_code,
+            "digest": None if stream else digest(response.content),
+        }
+        if not stream and self.max_body:
+            record["body"] = response.content[: self.max_body].decode(
+                "utf-8", errors="replace"
+            )
+        if json_data is not None:
+            record["json"] = json_data
+        elif isinstance(data, bytes):
+            record["data"] = base64.b64encode(data).decode("utf-8")
+        elif data is not None:
+            record["form"] = data
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            if self._fd is None or self._fd.closed:
+                return
+            self._fd.write(line + "\n")
+            self.count += 1
+            self._dirty = True
+            if self.count % self.flush_every == 0:
+                self.flush()
+
+    def flush(self):
+        """
+        Write what we have so far, so it can be read (the lock must be held).
+        """
+        if self._dirty and self._fd is not None and not self._fd.closed:
+            self._fd.flush()
+            self._dirty = False
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                self.flush()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._fd is not None and not self._fd.closed:
+                self._fd.close()
+        atexit.unregister(self.close)
+
+    def after_fork(self):
+        """
+        The log belongs to the parent. A forked child must not write to it,
+        or close it (which would add a gzip trailer in the middle).
+        """
+        atexit.unregister(self.close)
+        self._closed.set()
+        self._fd = None
+        self._lock = threading.Lock()
+
+
+def read_records(path):
+    """
+    Yield records from a recorded log. A log that was not closed (e.g.,
+    the process was killed) is read up to its last flush.
+    """
+    with gzip.open(path, "rt") as fd:
+        try:
+            for line in fd:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+        except EOFError:
+            return
+
+
+class Replayer:
+    """
+    Replay a recorded log against another server.
+
+    With speed=1 requests are sent at their original times, with speed=2
+    twice as fast, and with speed=None as fast as concurrency allows.
+    Returns latency distributions overall and by endpoint, counts of
+    responses that differ (status or body) from the recording, and a sample
+    (up to max_differences) of the differing responses with both bodies.
+    """
+
+    def __init__(self, path, client, speed=1.0, concurrency=8, max_differences=20):
+        self.path = path
+        self.client = client
+        self.speed = speed
+        self.concurrency = concurrency
+        self.max_differences = max_differences
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-replayer:%s]" % self.path
+
+    def send(self, record):
+        """
+        Send one recorded request, and compare the response.
+        """
+        data = record.get("form")
+        if "data" in record:
+            data = base64.b64decode(record["data"])
+        start = time.monotonic()
+        try:
+            r = self.client.do_request(
+                record["method"],
+                record["url"],
+                data=data,
+                json=record.get("json"),
+                return_json=False,
+                exit_on_error=False,
+            )
+        except ConnectionError:
+            return record, time.monotonic() - start, None, None, None
+        return (
+            record,
+            time.monotonic() - start,
+            r.status_code,
+            digest(r.content),
+            r.content,
+        )
+
+    def difference(self, record, status, content):
+        """
+        Describe a response that differs from the recording.
+        """
+        limit = len(record.get("body", "")) or 2048
+        return {
+            "method": record["method"],
+            "url": record["url"],
+            "model": record.get("model"),
+            "recorded_status": record["status"],
+            "status": status,
+            "recorded_body": record.get("body"),
+            "body": (
+                None
+                if content is None
+                else content[:limit].decode("utf-8", errors="replace")
+            ),
+        }
+
+    def run(self):
+        """
+        Replay the log and return a report.
+        """
+        records = (r for r in read_records(self.path) if r["digest"] is not None)
+        futures = []
+        start = time.monotonic()
+        first = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                if first is None:
+                    first = record["time"]
+                if self.speed:
+                    wait = (record["time"] - first) / self.speed
+                    delay = wait - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(executor.submit(self.send, record))
+
+        report = {
+            "requests": len(futures),
+            "seconds": time.monotonic() - start,
+            "errors": 0,
+            "status_mismatches": 0,
+            "response_mismatches": 0,
+            "differences": [],
+            "endpoints": {},
+        }
+        latencies = []
+        endpoints = {}
+        for future in futures:
+            record, latency, status, body, content = future.result()
+            latencies.append(latency)
+            endpoint = record["url"].split("?")[0]
+            endpoints.setdefault(endpoint, []).append(latency)
+            if status is None or status >= 400:
+                report["errors"] += 1
+            if status != record["status"]:
+                report["status_mismatches"] += 1
+            elif body != record["digest"]:
+                report["response_mismatches"] += 1
+            else:
+                continue
+            if len(report["differences"]) < self.max_differences:
+                report["differences"].append(self.difference(record, status, content))
+
+        report["latency"] = percentiles(latencies)
+        report["recorded_latency"] = percentiles(
+            [r["latency"] for r in read_records(self.path) if r["digest"] is not None]
+        )
+        for endpoint, values in endpoints.items():
+            report["endpoints"][endpoint] = percentiles(values)
+        logger.info(
+            "Replayed %s requests in %.2f seconds",
+            report["requests"],
+            report["seconds"],
+        )
+        return report
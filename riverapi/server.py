@@ -0,0 +1,251 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+# A small stand-in for a river server, for testing and benchmarking the
+# client. It implements the basic spec along with the columnar bulk
+# endpoints, and keeps models in memory. It is not meant for production!
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import riverapi.wire as wire
+
+import argparse
+import dill
+import json
+import threading
+import time
+import uuid
+
+
+class MeanModel:
+    """
+    A tiny regression model (predicts the running mean of y) so the
+    stand-in server works without river installed.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+
+    def learn_one(self, x, y):
+        self.n += 1
+        self.mean += (y - self.mean) / self.n
+
+    def predict_one(self, x):
+        return self.mean
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Handle requests for the stand-in server.
+    """
+
+    prefix = "/api"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.server.bytes_received += length
+        self.server.requests += 1
+        return body
+
+    def get_model(self, name):
+        model = self.server.models.get(name)
+        if model is None:
+            self.send_json({"message": "model %s not found" % name}, 404)
+        return model
+
+    def do_GET(self):
+        path = self.path[len(self.prefix) :]
+        body = self.read_body()
+        if path in ["", "/"]:
+            return self.send_json(
+                {
+                    "id": "riverapi_stand_in",
+                    "status": "running",
+                    "name": "River API Stand-in Server",
+                    "formats": wire.available_formats(),
+                    "version": "0.0.1",
+                }
+            )
+        if path == "/models/":
+            return self.send_json({"models": list(self.server.models)})
+        if path.startswith("/model/download/"):
+            model = self.get_model(path.strip("/").split("/")[-1])
+            if model is not None:
+                with self.server.lock:
+                    body = dill.dumps(model)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            return
+        if path in ["/stats/", "/metrics/"]:
+            name = json.loads(body or "{}").get("model")
+            if self.get_model(name) is not None:
+                self.send_json({})
+            return
+        self.send_json({"message": "not found"}, 404)
+
+    def do_POST(self):
+        path = self.path[len(self.prefix) :]
+        body = self.read_body()
+        content_type = self.headers.get("Content-Type")
+
+        if path.startswith("/model/"):
+            parts = [p for p in path.split("/") if p]
+            name = parts[2] if len(parts) > 2 else str(uuid.uuid4())
+            with self.server.lock:
+                self.server.models[name] = dill.loads(body)
+            return self.send_json({"name": name}, 201)
+
+        data = wire.decode(body, content_type)
+        model = self.get_model(data.get("model"))
+        if model is None:
+            return
+
+        with self.server.lock:
+            if path == "/learn/":
+                model.learn_one(data["features"], data.get("ground_truth"))
+                return self.send_json({}, 201)
+
+            if path == "/predict/":
+                prediction = model.predict_one(data["features"])
+                if data.get("ground_truth") is not None:
+                    model.learn_one(data["features"], data["ground_truth"])
+                return self.send_json(
+                    {"model": data["model"], "prediction": prediction}
+                )
+
+            if path == "/learn/batch/":
+                n = 0
+                for x, y in wire.iter_rows(data):
+                    model.learn_one(x, y)
+                    n += 1
+                return self.send_json({"model": data["model"], "learned": n}, 201)
+
+            if path == "/predict/batch/":
+                predictions = [model.predict_one(x) for x, _ in wire.iter_rows(data)]
+                return self.send_json(
+                    {"model": data["model"], "predictions": predictions}
+                )
+        self.send_json({"message": "not found"}, 404)
+
+    def do_DELETE(self):
+        path = self.path[len(self.prefix) :]
+        body = self.read_body().decode("utf-8")
+        name = parse_qs(body).get("model", [None])[0]
+        if path == "/model/" and self.get_model(name) is not None:
+            with self.server.lock:
+                del self.server.models[name]
+            self.send_json({}, 200)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Run the stand-in server in a background thread.
+
+    with StandInServer() as server:
+        cli = Client(server.baseurl)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), StandInHandler)
+        self.models = {}
+        self.lock = threading.Lock()
+        self.bytes_received = 0
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def baseurl(self):
+        return "http://%s:%s" % self.server_address[:2]
+
+    def add_model(self, name, model):
+        """
+        Add a model directly (without an upload)
+        """
+        self.models[name] = model
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def benchmark(n=10000, features=10, chunk_size=1000):
+    """
+    Compare bulk learning with one json request per sample against the
+    negotiated columnar format, and return bytes sent and time for each.
+    """
+    import numpy
+    from riverapi.main import Client
+
+    X = numpy.random.random((n, features))
+    y = numpy.random.random(n)
+    columns = ["feature_%s" % i for i in range(features)]
+    results = {}
+    for bulk_format in [None, "auto"]:
+        with StandInServer() as server:
+            server.add_model("model", MeanModel())
+            cli = Client(server.baseurl, quiet=True, bulk_format=bulk_format)
+            fmt = cli.negotiate_format() or "json"
+            server.bytes_received = 0
+            server.requests = 0
+            start = time.time()
+            cli.learn_many("model", X, y=y, columns=columns, chunk_size=chunk_size)
+            results[fmt] = {
+                "seconds": time.time() - start,
+                "bytes": server.bytes_received,
+                "requests": server.requests,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="River API stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument(
+        "--benchmark", action="store_true", help="benchmark bulk formats and exit"
+    )
+    parser.add_argument("-n", default=10000, type=int, help="samples to benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.n), indent=4))
+        return
+
+    server = StandInServer(args.host, args.port)
+    server.add_model("mean", MeanModel())
+    print("Stand-in server running at %s" % server.baseurl)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
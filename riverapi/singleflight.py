@@ -0,0 +1,79 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from copy import deepcopy
+
+import threading
+
+
+class Call:
+    """
+    A call in flight, that others can wait on for the result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Share one call among all threads that ask for the same thing at once.
+
+    The first caller for a key runs the call, and anyone asking for the
+    same key before it finishes waits and gets a copy of the same result
+    (or error). Nothing is cached after the call finishes.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-single-flight]"
+
+    def do(self, key, fn):
+        """
+        Run fn for a key, or wait for the call already running for it.
+        """
+        leader = False
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+            else:
+                call = Call()
+                self.calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        # Nobody can join after the call is removed, so if there are
+        # waiters the caller gets a copy they are free to change
+        if call.waiters:
+            return deepcopy(call.result)
+        return call.result
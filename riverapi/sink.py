@@ -0,0 +1,317 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+from riverapi.streams import StreamHub, event_model
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+# Columns of a captured event
+columns = ["time", "event", "model", "data"]
+
+# A block header: first and last time, number of rows, compressed size
+block_header = struct.Struct("<ddII")
+
+
+def have_parquet():
+    try:
+        import pyarrow.parquet  # noqa
+
+        return True
+    except ImportError:
+        return False
+
+
+def parse_line(line, received):
+    """
+    Split a streamed line (label: <value>) into a captured row.
+    """
+    label, _, value = line.partition(":")
+    if not value:
+        label, value = "", line
+    return received, label.strip(), event_model(line), value.strip()
+
+
+class BlockWriter:
+    """
+    Write batches as compressed blocks of json columns. Each block starts
+    with its time range, so a reader can skip blocks without inflating them.
+    This needs nothing beyond the standard library.
+    """
+
+    extension = "rcol"
+
+    def __init__(self, path):
+        self.fd = open(path, "ab")
+
+    def write(self, batch):
+        body = zlib.compress(json.dumps(batch, separators=(",", ":")).encode("utf-8"))
+        times = batch["time"]
+        self.fd.write(block_header.pack(times[0], times[-1], len(times), len(body)))
+        self.fd.write(body)
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+
+class ParquetWriter:
+    """
+    Write batches as row groups of one Parquet file (zstd compressed).
+    """
+
+    extension = "parquet"
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("time", pyarrow.float64()),
+                ("event", pyarrow.string()),
+                ("model", pyarrow.string()),
+                ("data", pyarrow.string()),
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(
+            path, self.schema, compression="zstd"
+        )
+
+    def write(self, batch):
+        self.writer.write_table(
+            self.pyarrow.Table.from_pydict(batch, schema=self.schema)
+        )
+
+    def close(self):
+        self.writer.close()
+
+
+writers = {"parquet": ParquetWriter, "blocks": BlockWriter}
+
+
+class StreamSink:
+    """
+    Capture a stream (events or metrics) to compressed columnar files.
+
+    Events are received through a StreamHub subscription (a bounded queue,
+    so a slow disk drops the oldest events instead of falling behind the
+    live stream) and written by a background thread in batches of up to
+    batch_size, at least every flush_interval seconds. A new file is
+    started every rotate seconds, named by the start of its window and when
+    the sink started (so a restarted sink never replaces a finished file).
+    Files are Parquet if pyarrow is installed, and compressed blocks otherwise.
+
+    with StreamSink(cli, "captures", stream="events") as sink:
+        time.sleep(3600)
+    """
+
+    def __init__(
+        self,
+        client,
+        root,
+        stream="events",
+        models=None,
+        batch_size=10000,
+        flush_interval=5.0,
+        rotate=3600,
+        max_buffer=100000,
+        format="auto",
+    ):
+        if format == "auto":
+            format = "parquet" if have_parquet() else "blocks"
+        if format not in writers:
+            logger.exit(
+                "%s is not a known format. Choices are: %s"
+                % (format, " ".join(writers))
+            )
+        self.hub = client if isinstance(client, StreamHub) else StreamHub(client)
+        self.root = os.path.abspath(root)
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate = rotate
+        self.writer_class = writers[format]
+        self.written = 0
+        self.batches = 0
+        self.files = 0
+        self._writer = None
+        self._window = None
+        self.started = time.time_ns() // 1000
+        os.makedirs(self.root, exist_ok=True)
+
+        self.subscription = self.hub.subscribe(stream, models, maxsize=max_buffer)
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-stream-sink:%s]" % self.root
+
+    @property
+    def dropped(self):
+        return self.subscription.dropped
+
+    def path(self, window, partial=False):
+        filename = "%s-%010d-%d-%d.%s" % (
+            self.stream,
+            window,
+            self.rotate,
+            self.started,
+            self.writer_class.extension,
+        )
+        return os.path.join(self.root, filename + (".part" if partial else ""))
+
+    def finish(self):
+        """
+        Close the current file, and give it its final name so readers see it.
+        """
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self.path(self._window, True), self.path(self._window))
+        self._writer = None
+        self._window = None
+
+    def write(self, rows):
+        """
+        Write received rows, starting a new file when a window ends.
+        """
+        while rows:
+            window = int(rows[0][0] // self.rotate * self.rotate)
+            count = 0
+            while count < len(rows) and rows[count][0] < window + self.rotate:
+                count += 1
+            if window != self._window:
+                self.finish()
+                self._window = window
+                self._writer = self.writer_class(self.path(window, True))
+                self.files += 1
+            batch = dict(zip(columns, (list(c) for c in zip(*rows[:count]))))
+            self._writer.write(batch)
+            self.written += count
+            self.batches += 1
+            rows = rows[count:]
+
+    def run(self):
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        closed = False
+        while not closed:
+            try:
+                line = self.subscription.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+                if line is None:
+                    closed = True
+                else:
+                    rows.append(parse_line(line, time.time()))
+            except queue.Empty:
+                pass
+            if len(rows) >= self.batch_size or closed or time.monotonic() >= deadline:
+                if rows:
+                    self.write(rows)
+                    rows = []
+                elif self._window is not None:
+                    if time.time() >= self._window + self.rotate:
+                        self.finish()
+                deadline = time.monotonic() + self.flush_interval
+        self.finish()
+
+    def close(self):
+        """
+        Stop capturing, and write what was received.
+        """
+        self.subscription.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_blocks(path, start=None, end=None):
+    """
+    Yield batches from a block file, skipping blocks outside of the time
+    range without inflating them. A partial block at the end is ignored.
+    """
+    with open(path, "rb") as fd:
+        while True:
+            header = fd.read(block_header.size)
+            if len(header) < block_header.size:
+                return
+            first, last, _, size = block_header.unpack(header)
+            if (start is not None and last < start) or (
+                end is not None and first >= end
+            ):
+                fd.seek(size, os.SEEK_CUR)
+                continue
+            body = fd.read(size)
+            if len(body) < size:
+                return
+            yield json.loads(zlib.decompress(body))
+
+
+def read_parquet(path, start=None, end=None):
+    """
+    Read a Parquet capture, using row group statistics to skip time.
+    """
+    import pyarrow.parquet
+
+    filters = []
+    if start is not None:
+        filters.append(("time", ">=", start))
+    if end is not None:
+        filters.append(("time", "<", end))
+    return pyarrow.parquet.read_table(path, filters=filters or None).to_pydict()
+
+
+def read_sink(root, start=None, end=None, stream="events", models=None):
+    """
+    Load captured rows between start and end (seconds since the epoch) as a
+    lookup of column name to values, e.g., for pandas.DataFrame(...). Files
+    outside of the range are skipped by name. Rows in the file still being
+    written are not included until it is rotated or the sink is closed.
+    """
+    result = {name: [] for name in columns}
+    models = set(models or [])
+    paths = []
+    for filename in os.listdir(root):
+        parts = filename.rsplit(".", 1)[0].rsplit("-", 3)
+        if filename.endswith(".part") or len(parts) != 4 or parts[0] != stream:
+            continue
+        window, rotate, started = int(parts[1]), int(parts[2]), int(parts[3])
+        if (start is not None and window + rotate <= start) or (
+            end is not None and window >= end
+        ):
+            continue
+        paths.append((window, started, os.path.join(root, filename)))
+
+    for _, _, path in sorted(paths):
+        if path.endswith(".parquet"):
+            batches = [read_parquet(path, start, end)]
+        else:
+            batches = iter_blocks(path, start, end)
+        for batch in batches:
+            for row in zip(*(batch[name] for name in columns)):
+                if start is not None and row[0] < start:
+                    continue
+                if end is not None and row[0] >= end:
+                    continue
+                if models and row[2] not in models:
+                    continue
+                for name, value in zip(columns, row):
+                    result[name].append(value)
+    return result
@@ -0,0 +1,249 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+import riverapi.utils as utils
+
+from contextlib import contextmanager
+
+import dill
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+
+class ModelCache:
+    """
+    A shared, on-disk cache of downloaded models.
+
+    Models are stored by name and content hash, <root>/<model>/<sha256>.pkl,
+    with a small meta.json that remembers the current digest and the ETag
+    the server gave us. A lock file per model (flock) means that when many
+    processes ask for the same model at once, only one downloads it and the
+    rest use the result. The least recently used models are evicted when
+    the cache exceeds max_size.
+    """
+
+    def __init__(self, root=None, max_size=2 * 1024**3, revalidate=60):
+        self.root = os.path.abspath(
+            root
+            or os.environ.get("RIVER_ML_CACHE")
+            or os.path.join(os.path.expanduser("~"), ".cache", "riverapi", "models")
+        )
+        self.max_size = max_size
+        self.revalidate = revalidate
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-model-cache:%s]" % self.root
+
+    @contextmanager
+    def lock(self, path, blocking=True):
+        """
+        Hold an exclusive (flock) lock on a lock file, yielding False if we
+        did not want to wait and someone else has it.
+        """
+        with open(path, "a") as fd:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def model_dir(self, model_name):
+        return os.path.join(self.root, model_name)
+
+    def read_meta(self, model_name):
+        """
+        Read the metadata for a model, if we have it.
+        """
+        path = os.path.join(self.model_dir(model_name), "meta.json")
+        if not os.path.exists(path):
+            return {}
+        return utils.read_json(path)
+
+    def write_meta(self, model_name, meta):
+        """
+        Atomically write metadata for a model.
+        """
+        path = os.path.join(self.model_dir(model_name), "meta.json")
+        tmp = "%s.%s" % (path, os.getpid())
+        utils.write_json(meta, tmp)
+        os.replace(tmp, path)
+
+    def path(self, model_name, meta=None):
+        """
+        Get the path to the current cached version of a model, or None.
+        """
+        meta = meta or self.read_meta(model_name)
+        if "digest" not in meta:
+            return None
+        path = os.path.join(self.model_dir(model_name), "%s.pkl" % meta["digest"])
+        if os.path.exists(path):
+            return path
+
+    def fetch(self, client, model_name):
+        """
+        Get the path to a cached model, downloading it if we must.
+
+        A version checked less than revalidate seconds ago is used without
+        asking the server. Otherwise we ask with the ETag we have, and a
+        304 means our copy is still current.
+        """
+        started = time.time()
+        with self.lock(self.lockfile(model_name)):
+            path = self._fetch(client, model_name)
+        self.evict(since=started)
+        return path
+
+    def get(self, client, model_name):
+        """
+        Fetch and load a model. The file is opened while we hold the model
+        lock, so another process evicting it can't remove it before we read.
+        """
+        started = time.time()
+        with self.lock(self.lockfile(model_name)):
+            f = open(self._fetch(client, model_name), "rb")
+        with f:
+            self.evict(since=started)
+            return self.read(f)
+
+    def lockfile(self, model_name):
+        dirname = self.model_dir(model_name)
+        os.makedirs(dirname, exist_ok=True)
+        return os.path.join(dirname, ".lock")
+
+    def _fetch(self, client, model_name):
+        """
+        Fetch a model (the model lock must be held).
+        """
+        meta = self.read_meta(model_name)
+        path = self.path(model_name, meta)
+        if path and time.time() - meta.get("checked", 0) < self.revalidate:
+            os.utime(path)
+            return path
+
+        headers = {}
+        if path and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        r = client.do_request(
+            "get",
+            "/model/download/%s/" % model_name,
+            headers=headers,
+            return_json=False,
+            stream=True,
+        )
+        if r.status_code == 304 and path:
+            meta["checked"] = time.time()
+            self.write_meta(model_name, meta)
+            os.utime(path)
+            return path
+
+        path = self.save(model_name, r)
+        meta = {
+            "digest": os.path.basename(path).rsplit(".", 1)[0],
+            "etag": r.headers.get("ETag"),
+            "checked": time.time(),
+        }
+        self.write_meta(model_name, meta)
+        self.remove_stale(model_name, path)
+        return path
+
+    def save(self, model_name, response):
+        """
+        Stream a download to a temporary file, and name it by content hash.
+        """
+        dirname = self.model_dir(model_name)
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+        path = os.path.join(dirname, "%s.pkl" % digest.hexdigest())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+        return path
+
+    def remove_stale(self, model_name, keep):
+        """
+        Remove older versions of a model.
+        """
+        dirname = self.model_dir(model_name)
+        for filename in os.listdir(dirname):
+            path = os.path.join(dirname, filename)
+            if filename.endswith(".pkl") and path != keep:
+                os.remove(path)
+
+    def load(self, path):
+        """
+        Load a model from a cached file.
+        """
+        with open(path, "rb") as f:
+            return self.read(f)
+
+    def read(self, f):
+        """
+        Load a model from an open file through a memory map. Processes on the
+        same node read the file from the same page cache, but each one still
+        builds its own copy of the model in memory.
+        """
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return dill.load(mm)
+
+    def size(self):
+        """
+        Total size (in bytes) of cached models.
+        """
+        return sum(os.path.getsize(path) for path, _ in self.iter_models())
+
+    def iter_models(self):
+        """
+        Yield (path, model name) for every cached model file.
+        """
+        for model_name in os.listdir(self.root):
+            dirname = self.model_dir(model_name)
+            if not os.path.isdir(dirname):
+                continue
+            for filename in os.listdir(dirname):
+                if filename.endswith(".pkl"):
+                    yield os.path.join(dirname, filename), model_name
+
+    def evict(self, since=None):
+        """
+        Remove least recently used models until we are under max_size.
+        Models that another process holds the lock for, and any used since
+        a fetch started (since), are skipped.
+        """
+        with self.lock(os.path.join(self.root, ".lock"), blocking=False) as locked:
+            if not locked:
+                return
+            models = []
+            for path, model_name in self.iter_models():
+                st = os.stat(path)
+                models.append((st.st_mtime, st.st_size, path, model_name))
+            total = sum(m[1] for m in models)
+            for mtime, size, path, model_name in sorted(models):
+                if total <= self.max_size:
+                    break
+                if since is not None and mtime >= since:
+                    continue
+                lockfile = os.path.join(self.model_dir(model_name), ".lock")
+                with self.lock(lockfile, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    logger.debug("Evicting %s from model cache" % path)
+                    os.remove(path)
+                    total -= size
@@ -0,0 +1,259 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+
+import json
+import queue
+import threading
+import time
+
+# Policies for a subscriber that falls behind (its queue is full)
+policies = ["drop_oldest", "block", "disconnect"]
+
+# Sent to a subscriber queue to say there are no more events
+_closed = object()
+
+
+def event_model(line):
+    """
+    Get the model name from a streamed line (label: <value>), if the value
+    is a dictionary (json) with a model. Otherwise return None.
+    """
+    value = line.split(":", 1)[-1].strip()
+    try:
+        event = json.loads(value)
+    except ValueError:
+        return None
+    if isinstance(event, dict):
+        return event.get("model")
+
+
+class Subscription:
+    """
+    One consumer of a shared stream, with its own bounded queue.
+
+    for event in subscription:
+        print(event)
+    """
+
+    def __init__(self, hub, key, models=None, maxsize=1000, policy="drop_oldest"):
+        if policy not in policies:
+            logger.exit(
+                "%s is not a valid policy. Choices are: %s"
+                % (policy, " ".join(policies))
+            )
+        self.hub = hub
+        self.key = key
+        self.models = set(models or [])
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-subscription:%s]" % self.key[0]
+
+    def matches(self, line):
+        """
+        Client-side filter by model name. If we can't parse a model from
+        the event, we fall back to looking for the name in the line.
+        """
+        if not self.models:
+            return True
+        model = event_model(line)
+        if model is None:
+            return any(name in line for name in self.models)
+        return model in self.models
+
+    def put(self, line):
+        """
+        Add an event, following the policy if we are behind. A closed
+        subscription (e.g., closed after the upstream took its list of
+        subscribers) ignores it.
+        """
+        if self.closed:
+            return
+        if self.policy == "block":
+            self.queue.put(line)
+            return
+        try:
+            self.queue.put_nowait(line)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == "disconnect":
+            logger.warning("%s is too slow, disconnecting." % self)
+            self.dropped += 1
+            self.close()
+            return
+
+        # Drop the oldest event to make room for the newest
+        try:
+            self.queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """
+        Get the next event, or None if the subscription is closed. Once
+        closed, anything left in the queue is returned without waiting.
+        """
+        if self.closed:
+            try:
+                line = self.queue.get_nowait()
+            except queue.Empty:
+                return None
+        else:
+            line = self.queue.get(timeout=timeout)
+        if line is _closed:
+            return None
+        self.received += 1
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.get()
+            if line is None:
+                return
+            yield line
+
+    def close(self):
+        """
+        Stop receiving events. Anything already queued can still be read.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.hub.unsubscribe(self)
+        while True:
+            try:
+                self.queue.put_nowait(_closed)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StreamHub:
+    """
+    Share one upstream connection per stream among many consumers.
+
+    Each upstream (events or metrics) is read by a background thread that
+    fans events out to subscribers. With server_filter, the model is sent
+    to the server to filter, and each model gets its own upstream.
+
+    hub = StreamHub(cli)
+    with hub.subscribe("events", models=["fugly-mango"]) as events:
+        for event in events:
+            print(event)
+    """
+
+    def __init__(self, client, reconnect=1.0):
+        self.client = client
+        self.reconnect = reconnect
+        self.subscribers = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "[riverapi-stream-hub]"
+
+    def subscribe(
+        self,
+        stream="events",
+        models=None,
+        maxsize=1000,
+        policy="drop_oldest",
+        server_filter=False,
+    ):
+        """
+        Subscribe to a stream (events or metrics), optionally filtered to
+        one or more model names.
+        """
+        if stream not in ["events", "metrics"]:
+            logger.exit("%s is not a known stream, choose events or metrics." % stream)
+        if isinstance(models, str):
+            models = [models]
+
+        model = None
+        if server_filter:
+            if not models or len(models) != 1:
+                logger.exit("A server filter requires exactly one model name.")
+            model = models[0]
+
+        key = (stream, model)
+        sub = Subscription(self, key, models, maxsize=maxsize, policy=policy)
+        with self.lock:
+            self.subscribers.setdefault(key, []).append(sub)
+            if key not in self.threads:
+                thread = threading.Thread(target=self.run, args=(key,), daemon=True)
+                self.threads[key] = thread
+                thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            subs = self.subscribers.get(sub.key, [])
+            if sub in subs:
+                subs.remove(sub)
+
+    def run(self, key):
+        """
+        Read an upstream and fan out events until nobody is subscribed.
+        The upstream is reconnected if it drops.
+        """
+        stream, model = key
+        url = "/stream/%s/" % stream
+        if model:
+            url += "?model=%s" % model
+
+        while True:
+            try:
+                for line in self.client.stream(url):
+                    with self.lock:
+                        subs = list(self.subscribers.get(key, []))
+                        if not subs:
+                            self.threads.pop(key, None)
+                            return
+                    for sub in subs:
+                        if sub.matches(line):
+                            sub.put(line)
+            except (Exception, SystemExit) as e:
+                logger.warning("Stream %s disconnected: %s" % (stream, e))
+            with self.lock:
+                if not self.subscribers.get(key):
+                    self.threads.pop(key, None)
+                    return
+            time.sleep(self.reconnect)
+
+    def close(self):
+        """
+        Close all subscriptions. Upstreams stop at their next event.
+        """
+        with self.lock:
+            subs = [s for subs in self.subscribers.values() for s in subs]
+        for sub in subs:
+            sub.close()
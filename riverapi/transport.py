@@ -0,0 +1,332 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+
+from urllib.parse import urlencode, urlsplit
+
+import json as jsonlib
+import socket
+import requests
+import urllib3
+
+
+class TransportError(requests.ConnectionError, ConnectionError):
+    """
+    A connection failure. This is both a requests ConnectionError (what
+    the client raised before transports) and the builtin ConnectionError.
+    """
+
+
+class Request:
+    """
+    A request that can be sent again (e.g., after authentication).
+    """
+
+    def __init__(self, method, url, headers=None, body=None, stream=False):
+        self.method = method
+        self.url = url
+        self.headers = headers or {}
+        self.body = body
+        self.stream = stream
+
+
+class Response:
+    """
+    A minimal response, shaped like a requests.Response, for transports
+    that are not requests.
+    """
+
+    def __init__(self, status_code, reason, headers, url, request, raw=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self.request = request
+        self.raw = raw
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b"".join(self.iter_content())
+        return self._content
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        if self._content is not None:
+            yield self._content
+            return
+        yield from self.raw.stream(chunk_size)
+
+    def iter_lines(self, chunk_size=512):
+        pending = b""
+        for chunk in self.iter_content(chunk_size):
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending
+
+    def __iter__(self):
+        return self.iter_content(128)
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.release_conn()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Transport:
+    """
+    A transport sends requests to the server. Connection failures are
+    raised as a TransportError, whatever library is underneath.
+    """
+
+    def request(self, method, url, data=None, json=None, headers=None, stream=False):
+        headers = dict(headers or {})
+        body = data
+        if json is not None:
+            body = jsonlib.dumps(json).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif isinstance(data, dict):
+            body = urlencode(data).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return self.send(Request(method.upper(), url, headers, body, stream))
+
+    def send(self, request):
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Start over with new connections (e.g., in a forked child, where
+        the parent's connections must not be shared).
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    The default transport, a requests session (kept alive connections).
+    """
+
+    def __init__(self, session=None):
+        self.session = session or requests.session()
+
+    def request(self, method, url, data=None, json=None, headers=None, stream=False):
+        try:
+            return self.session.request(
+                method, url, data=data, json=json, headers=headers, stream=stream
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransportError(str(e)) from e
+
+    def send(self, request):
+        try:
+            return self.session.send(request)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransportError(str(e)) from e
+
+    def reset(self):
+        # Keep the session (and any settings), but not the connections
+        for adapter in self.session.adapters.values():
+            adapter.proxy_manager = {}
+            adapter.init_poolmanager(
+                adapter._pool_connections,
+                adapter._pool_maxsize,
+                block=adapter._pool_block,
+            )
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """
+    Use urllib3 directly, skipping the requests layer on top of it.
+    """
+
+    def __init__(self, maxsize=10):
+        self.maxsize = maxsize
+        self.pool = urllib3.PoolManager(maxsize=maxsize)
+
+    def urlopen(self, request):
+        return self.pool.request(
+            request.method,
+            request.url,
+            body=request.body,
+            headers=request.headers,
+            preload_content=False,
+            retries=False,
+        )
+
+    def send(self, request):
+        try:
+            raw = self.urlopen(request)
+        except urllib3.exceptions.HTTPError as e:
+            raise TransportError(str(e)) from e
+        r = Response(raw.status, raw.reason, raw.headers, request.url, request, raw)
+        if not request.stream:
+            r.content
+            r.close()
+        return r
+
+    def reset(self):
+        self.pool = urllib3.PoolManager(maxsize=self.maxsize)
+
+    def close(self):
+        self.pool.clear()
+
+
+class UnixHTTPConnection(urllib3.connection.HTTPConnection):
+    """
+    An HTTP connection over a Unix domain socket.
+    """
+
+    def __init__(self, *args, socket_path=None, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise urllib3.exceptions.NewConnectionError(
+                self, "Failed to connect to %s: %s" % (self.socket_path, e)
+            ) from e
+        return sock
+
+
+class UnixHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+
+class UnixSocketTransport(Urllib3Transport):
+    """
+    Talk to a server on the same host over a Unix domain socket, e.g.,
+    Client("unix:///run/river.sock"). This skips the TCP stack, and
+    connections are kept alive in a small pool.
+    """
+
+    def __init__(self, socket_path, maxsize=10):
+        self.socket_path = socket_path
+        self.maxsize = maxsize
+        self.reset()
+
+    def reset(self):
+        self.pool = UnixHTTPConnectionPool(
+            "localhost", maxsize=self.maxsize, socket_path=self.socket_path
+        )
+
+    def urlopen(self, request):
+        parts = urlsplit(request.url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        return self.pool.urlopen(
+            request.method,
+            path,
+            body=request.body,
+            headers=request.headers,
+            preload_content=False,
+            retries=False,
+        )
+
+    def close(self):
+        self.pool.close()
+
+
+class HTTPXTransport(Transport):
+    """
+    Use httpx, which can multiplex many requests over one HTTP/2
+    connection (install httpx[http2] for that).
+    """
+
+    def __init__(self, http2=True):
+        try:
+            import httpx
+        except ImportError:
+            logger.exit("Please pip install httpx[http2] to use this transport.")
+        self.httpx = httpx
+        self.http2 = http2
+        self.client = httpx.Client(http2=http2)
+
+    def send(self, request):
+        try:
+            raw = self.client.send(
+                self.client.build_request(
+                    request.method,
+                    request.url,
+                    headers=request.headers,
+                    content=request.body,
+                ),
+                stream=request.stream,
+            )
+        except self.httpx.TransportError as e:
+            raise TransportError(str(e)) from e
+        r = Response(
+            raw.status_code, raw.reason_phrase, raw.headers, request.url, request
+        )
+        if request.stream:
+            r.iter_content = lambda chunk_size=65536: raw.iter_bytes(chunk_size)
+            r.close = raw.close
+        else:
+            r._content = raw.content
+        return r
+
+    def reset(self):
+        self.client = self.httpx.Client(http2=self.http2)
+
+    def close(self):
+        self.client.close()
+
+
+transports = {
+    "requests": RequestsTransport,
+    "urllib3": Urllib3Transport,
+    "httpx": HTTPXTransport,
+}
+
+
+def transport_name(transport):
+    """
+    Get the name of a transport (or instance) to create it again, e.g.,
+    in another process. A custom transport falls back to the default.
+    """
+    if transport is None or isinstance(transport, str):
+        return transport
+    for name, cls in transports.items():
+        if type(transport) is cls:
+            return name
+
+
+def get_transport(baseurl, transport=None):
+    """
+    Get a transport for a baseurl (and name or instance), returning the
+    transport and the baseurl to build urls with. A unix:// baseurl
+    always uses a Unix domain socket.
+    """
+    if baseurl.startswith("unix://"):
+        return UnixSocketTransport(baseurl[len("unix://") :]), "http://localhost"
+    if isinstance(transport, Transport):
+        return transport, baseurl
+    if transport not in transports and transport is not None:
+        logger.exit(
+            "%s is not a known transport. Choices are: %s"
+            % (transport, " ".join(transports))
+        )
+    return transports[transport or "requests"](), baseurl
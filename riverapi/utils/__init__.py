@@ -11,3 +11,6 @@ from .fileio import (
     write_file,
     write_json,
 )
+from .fork import on_fork
+from .frames import iter_columns, iter_records
+from .stream import iter_json_list
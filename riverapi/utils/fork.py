@@ -0,0 +1,26 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+import os
+import weakref
+
+# Objects to fix up in a forked child, and the method to call
+_objects = weakref.WeakKeyDictionary()
+
+
+def _after_fork():
+    for obj, method in list(_objects.items()):
+        getattr(obj, method)()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def on_fork(obj, method="after_fork"):
+    """
+    Call a method of obj in a forked child (threads, locks and connections
+    are not safe to use there as they are in the parent).
+    """
+    _objects[obj] = method
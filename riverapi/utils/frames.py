@@ -0,0 +1,76 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+from riverapi.logger import logger
+
+# numpy and pandas are optional, and only imported when used
+
+
+def split_target(X, y=None, columns=None, target=None):
+    """
+    Given a DataFrame or 2-D array (and optionally the name of a target
+    column in it) return (X, y, columns) with the target column removed.
+    """
+    import numpy
+
+    if hasattr(X, "columns"):
+        columns = list(X.columns) if columns is None else list(columns)
+        if target is not None:
+            y = X[target]
+            columns = [c for c in columns if c != target]
+        return X[columns], y, columns
+
+    X = numpy.asarray(X)
+    if X.ndim != 2:
+        logger.exit("X must be a 2-D array, found %s dimensions." % X.ndim)
+    if columns is None:
+        columns = ["x%s" % i for i in range(X.shape[1])]
+    columns = list(columns)
+    if len(columns) != X.shape[1]:
+        logger.exit("Found %s columns for %s features." % (len(columns), X.shape[1]))
+    if target is not None:
+        index = columns.index(target) if not isinstance(target, int) else target
+        y = X[:, index]
+        X = numpy.delete(X, index, axis=1)
+        columns = columns[:index] + columns[index + 1 :]
+    return X, y, columns
+
+
+def to_columns(X, columns):
+    """
+    Convert a chunk of a DataFrame or 2-D array to a list of plain Python
+    lists, one per column. tolist is done per column in C, and gives us
+    native types (not numpy scalars) that serialize to json.
+    """
+    if hasattr(X, "columns"):
+        return [X[c].tolist() for c in columns]
+    return X.T.tolist()
+
+
+def iter_columns(X, y=None, columns=None, target=None, chunk_size=1000):
+    """
+    Yield (columns, values, labels) chunks from a DataFrame or 2-D array,
+    where values is a list of plain lists (one per column) and labels is
+    a list (or None).
+    """
+    X, y, columns = split_target(X, y=y, columns=columns, target=target)
+    if y is not None and hasattr(y, "tolist"):
+        y = y.tolist()
+    for start in range(0, len(X), chunk_size):
+        chunk = X.iloc if hasattr(X, "iloc") else X
+        chunk = chunk[start : start + chunk_size]
+        labels = None if y is None else list(y[start : start + chunk_size])
+        yield columns, to_columns(chunk, columns), labels
+
+
+def iter_records(X, y=None, columns=None, target=None, chunk_size=1000):
+    """
+    Yield (records, labels) chunks from a DataFrame or 2-D array, where
+    records is a list of feature dictionaries and labels is a list (or None).
+    """
+    for names, values, labels in iter_columns(
+        X, y=y, columns=columns, target=target, chunk_size=chunk_size
+    ):
+        records = [dict(zip(names, row)) for row in zip(*values)]
+        yield records, labels
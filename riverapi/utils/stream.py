@@ -0,0 +1,69 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+import codecs
+import json
+
+
+def iter_json_list(chunks, key):
+    """
+    Yield items of a list in a json object (e.g., {"models": [...]}) as the
+    chunks of bytes arrive, without loading the whole document.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = None
+
+    def more():
+        for chunk in chunks:
+            text = utf8.decode(chunk)
+            if text:
+                return text
+        return None
+
+    # Find the start of the list for the key
+    while position is None:
+        start = buffer.find('"%s"' % key)
+        if start != -1:
+            bracket = buffer.find("[", start)
+            if bracket != -1:
+                position = bracket + 1
+                break
+        text = more()
+        if text is None:
+            return
+        buffer += text
+
+    while True:
+        # Skip whitespace and commas between items
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position >= len(buffer):
+                raise ValueError("need more data")
+            item, end = decoder.raw_decode(buffer, position)
+
+            # An item is only complete when a comma or the end of the list
+            # follows (e.g., a number at the end of the buffer might continue)
+            after = end
+            while after < len(buffer) and buffer[after] in " \t\r\n":
+                after += 1
+            if after == len(buffer) or buffer[after] not in ",]":
+                raise ValueError("need more data")
+        except ValueError:
+            text = more()
+            if text is None:
+                if position < len(buffer):
+                    item, end = decoder.raw_decode(buffer, position)
+                    yield item
+                return
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+        yield item
+        position = end
@@ -0,0 +1,79 @@
+__author__ = "Vanessa Sochat"
+__copyright__ = "Copyright 2022, Vanessa Sochat"
+__license__ = "MPL 2.0"
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Compact formats for bulk requests, in order of preference. The schema
+# (column names) is sent once, followed by one array of values per column.
+content_types = {
+    "columnar-msgpack": "application/msgpack",
+    "columnar-json": "application/json",
+}
+
+
+def available_formats():
+    """
+    Formats this client can encode (msgpack is optional).
+    """
+    formats = list(content_types)
+    if msgpack is None:
+        formats.remove("columnar-msgpack")
+    return formats
+
+
+def choose_format(server_formats):
+    """
+    Choose the best format that both the client and server support, or None
+    if we need to fall back to one json request per sample.
+    """
+    for fmt in available_formats():
+        if fmt in (server_formats or []):
+            return fmt
+
+
+def encode(payload, fmt):
+    """
+    Encode a columnar payload, returning (body, content type)
+    """
+    if fmt == "columnar-msgpack":
+        return msgpack.packb(payload, use_bin_type=True), content_types[fmt]
+    return (
+        json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+        content_types[fmt],
+    )
+
+
+def decode(body, content_type):
+    """
+    Decode a request or response body based on the content type.
+    """
+    if content_type and content_type.startswith(content_types["columnar-msgpack"]):
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def columnar_payload(model_name, columns, values, labels=None):
+    """
+    Build the payload for a bulk request: the schema once, and then one
+    list of values per column (and optionally the labels).
+    """
+    payload = {"model": model_name, "columns": columns, "features": values}
+    if labels is not None:
+        payload["ground_truth"] = labels
+    return payload
+
+
+def iter_rows(payload):
+    """
+    Turn a columnar payload back into (features, label) per sample.
+    """
+    columns = payload["columns"]
+    labels = payload.get("ground_truth")
+    for i, row in enumerate(zip(*payload["features"])):
+        yield dict(zip(columns, row)), None if labels is None else labels[i]